@@ -464,7 +464,8 @@ class Alignment:
         if not messages or not filepath_output_oneline:
             return []
         
-        aligned_messages = copy.deepcopy(messages)
+        # only .data differs from the original messages, so a shallow copy is enough
+        aligned_messages = [copy.copy(message) for message in messages]
         
         try:
             with open(filepath_output_oneline, 'r') as f:
@@ -1,14 +1,17 @@
 import numpy as np
-from sklearn import metrics
 import logging
 import struct
+import re
 
 class Clustering:
-    def __init__(self, fields, protocol_type):
-        self.fields = fields
+    def __init__(self, layout, protocol_type):
+        self.layout = layout
         self.protocol_type = protocol_type
         
     def evaluation(self, clustering_result_true, clustering_result_method):
+        # sklearn is slow to import, only load it for the evaluation
+        from sklearn import metrics
+
         print("[++++++++] Evaluate Clustering results")
         results_list = list()
         labels_true_list, labels_method_list = list(), list()
@@ -97,10 +100,7 @@ class Clustering:
         print("[++++++++] Cluster by Inferred Keyword")
         results = [list() for message in messages]
         for fid_inferred in fid_inferred_list:
-            il, ir = 0, 0
-            for i in range(fid_inferred):
-                il += self.fields[i].domain.dataType.size[1] // 8
-            ir = il + (self.fields[fid_inferred].domain.dataType.size[1] // 8)
+            il, ir = self.layout.slice(fid_inferred)
 
             for j in range(len(messages)):
                 results[j].append(messages[j].data[il:ir])
@@ -0,0 +1,145 @@
+import logging
+
+from constraint.constraint import Constraint
+from constraint.remote_coupling import RemoteCoupling
+from probabilistic_inference import ProbabilisticInference
+
+class CompositeKeywordSearch:
+    """Beam search over composite keywords (the message type is encoded by several fields)
+
+    A composite keyword is a tuple of fields, its messages are clustered by the values of all the fields,
+    and it is scored by the same m/r/s/d/v constraints and factor graph as a single field.
+    Level n only extends the beam_width best keywords of level n-1 with the best single fields, and
+    combinations are pruned before scoring by bounds that hold for all their supersets:
+      - too many symbols: adding a field only splits clusters, so it can't become valid again
+      - no new split: the combination clusters the messages exactly like one of its parts
+    and by an upper bound of their pk: the pk with their cheap observations (r/s/d/v) and the best p_m of all the
+    scored fid pairs, since the similarity is the costly one. It is computed by the same inference, and the combinations
+    bounded below the weakest keyword of the beam are dropped. pk only grows with each observation when all the
+    implication probabilities are > 0.5, otherwise nothing is pruned. The bound holds under the normalization of
+    the pairs scored so far; scoring a combination can lower the min of p_m and shift the pk of the others,
+    so the pruning is a heuristic, not an exact search.
+    The search stops when a level doesn't improve the best pk.
+    """
+    # same limits as Constraint.filter_fields
+    MAX_NUM_SYMBOLS = 50
+    MIN_MSGS_PER_SYMBOL = 1.5
+
+    def __init__(self, constraint, beam_width=3, max_fields=2):
+        self.constraint = constraint
+        self.beam_width = beam_width
+        self.max_fields = max_fields
+
+    # pairs_p/pairs_size: [request, response] results of the single fields
+    # fid_list: the single keyword candidates
+    # output: pairs_p/pairs_size with the composite keywords, and all the fids to infer ("3-3", "3+5-3+5", ...)
+    def execute(self, pairs_p, pairs_size, fid_list):
+        print("[++++++++] Search composite keywords")
+        pairs_p_request, pairs_p_response = pairs_p
+        pairs_size_request, pairs_size_response = pairs_size
+        # the dicts of the inferred direction, updated in place with the composite keywords
+        direction = self.constraint.get_inference_direction()
+
+        ffid_list = [Constraint.get_fid_pair_name(fid, fid) for fid in fid_list]
+        pk = self.compute_pk(pairs_p[direction], pairs_size[direction], ffid_list)
+        if len(pk) == 0:
+            return pairs_p, pairs_size, ffid_list
+
+        singles = sorted([fid for fid in fid_list if Constraint.get_fid_pair_name(fid, fid) in pk],
+                         key=lambda fid: pk[Constraint.get_fid_pair_name(fid, fid)], reverse=True)
+        pool = singles[:2 * self.beam_width]
+        beam = [(fid,) for fid in singles[:self.beam_width]]
+        pk_best = max(pk.values())
+
+        for num_fields in range(2, self.max_fields + 1):
+            candidates = list()
+            for keyword in beam:
+                for fid in pool:
+                    if fid in keyword:
+                        continue
+                    candidate = tuple(sorted(keyword + (fid,)))
+                    if candidate not in candidates and self.is_valid(candidate):
+                        candidates.append(candidate)
+            # the combinations that can't beat the weakest keyword of the beam are not scored
+            num_candidates = len(candidates)
+            if self.is_bound_valid():
+                pk_min = min(pk[Constraint.get_fid_pair_name(keyword, keyword)] for keyword in beam)
+                candidates = [candidate for candidate in candidates
+                              if self.compute_pk_bound(pairs_p[direction], pairs_size[direction], ffid_list, candidate, direction) > pk_min]
+            logging.info("[++++] Composite keywords of {} fields: {} candidates ({} pruned by the pk bound)".format(num_fields, len(candidates), num_candidates - len(candidates)))
+            if len(candidates) == 0:
+                break
+
+            # score the candidates with the constraints
+            pairs_p_new, pairs_size_new = self.constraint.evaluate_fid_pairs([(candidate, candidate) for candidate in candidates])
+            pairs_p_request.update(pairs_p_new[0])
+            pairs_p_response.update(pairs_p_new[1])
+            pairs_size_request.update(pairs_size_new[0])
+            pairs_size_response.update(pairs_size_new[1])
+            ffid_list += [Constraint.get_fid_pair_name(candidate, candidate) for candidate in candidates]
+
+            # the observation probabilities are normalized over all fids, so pk is computed again
+            pk = self.compute_pk(pairs_p[direction], pairs_size[direction], ffid_list)
+            candidates = sorted([candidate for candidate in candidates if Constraint.get_fid_pair_name(candidate, candidate) in pk],
+                                key=lambda candidate: pk[Constraint.get_fid_pair_name(candidate, candidate)], reverse=True)
+            if len(candidates) == 0:
+                break
+            pk_level = pk[Constraint.get_fid_pair_name(candidates[0], candidates[0])]
+            logging.debug("Best composite keyword of {} fields: {} ({})".format(num_fields, candidates[0], pk_level))
+
+            beam = candidates[:self.beam_width]
+            if pk_level <= pk_best:
+                break
+            pk_best = pk_level
+
+        return [pairs_p_request, pairs_p_response], [pairs_size_request, pairs_size_response], ffid_list
+
+    def compute_pk(self, pairs_p, pairs_size, ffid_list):
+        pi = ProbabilisticInference(pairs_p=pairs_p, pairs_size=pairs_size)
+        fg_result = pi.compute_fg_result(ffid_list)
+
+        return {ffid: pk_list[0] for ffid, pk_list in fg_result.items()}
+
+    # pk grows with each observation only if all the implication probabilities are > 0.5
+    @staticmethod
+    def is_bound_valid():
+        return all(getattr(ProbabilisticInference, name) > 0.5 for name in ProbabilisticInference.PARAMETERS if name.startswith('P_'))
+
+    # pk of the keyword with its p_r/p_s/p_d/p_v in the inferred direction and, for each cluster, the best p_m of all
+    # the scored fid pairs (the min-max normalization of p_m covers all of them, with the -fp pairs)
+    def compute_pk_bound(self, pairs_p, pairs_size, ffid_list, keyword, direction):
+        clusters = self.constraint.get_clusters(direction, keyword)
+        p_m_list = [p for ffid in pairs_p for p in pairs_p[ffid][0] if p >= 0]
+        p_m = max(p_m_list) if p_m_list else 1.0
+
+        rc = RemoteCoupling(clusters_request=self.constraint.get_clusters(Constraint.TEST_TYPE_REQUEST, keyword),
+                            clusters_response=self.constraint.get_clusters(Constraint.TEST_TYPE_RESPONSE, keyword),
+                            session_pairs=self.constraint.session_pairs)
+        rc.compute_pairs_by_directionlist()
+        p_r = rc.compute_constraint_remote_coupling(direction)
+        p_s = self.constraint.compute_constraint_structure(clusters, self.constraint.gaps[direction], self.constraint.gaps_count[direction])
+
+        name = Constraint.get_fid_pair_name(keyword, keyword)
+        pairs_p_bound, pairs_size_bound = dict(pairs_p), dict(pairs_size)
+        pairs_p_bound[name] = [[p_m] * len(clusters), p_r, p_s,
+                               self.constraint.compute_constraint_dimension(clusters), self.constraint.compute_constraint_value(clusters)]
+        pairs_size_bound[name] = clusters.sizes.tolist()
+        pk = self.compute_pk(pairs_p_bound, pairs_size_bound, ffid_list + [name])
+
+        return pk.get(name, 0.0)
+
+    def is_valid(self, keyword):
+        for direction in [Constraint.TEST_TYPE_REQUEST, Constraint.TEST_TYPE_RESPONSE]:
+            clusters = self.constraint.get_clusters(direction, keyword)
+            # a direction without messages doesn't constrain the keyword
+            if len(clusters) == 0:
+                continue
+            num_msgs = len(clusters.labels)
+            if len(clusters) > CompositeKeywordSearch.MAX_NUM_SYMBOLS or num_msgs / len(clusters) < CompositeKeywordSearch.MIN_MSGS_PER_SYMBOL:
+                return False
+        # at least one direction is split more finely than by each part alone
+        for direction in [Constraint.TEST_TYPE_REQUEST, Constraint.TEST_TYPE_RESPONSE]:
+            num_parts = max(len(self.constraint.get_clusters(direction, fid)) for fid in keyword)
+            if len(self.constraint.get_clusters(direction, keyword)) > num_parts:
+                return True
+        return False
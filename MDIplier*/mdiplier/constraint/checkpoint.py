@@ -0,0 +1,79 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from alignment import Alignment
+
+class CheckpointStore:
+    """Append-only store of the observation probabilities of each fid pair
+
+    Rows are written as soon as a fid pair is computed, so an interrupted run can resume.
+    key: hash of the alignment and the direction list, rows of other alignments are ignored
+    """
+    FILENAME = "observation_checkpoint.sqlite"
+
+    def __init__(self, filepath, key):
+        self.filepath = filepath
+        self.key = key
+
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pairs ("
+            "key TEXT NOT NULL, fid_pair TEXT NOT NULL, "
+            "p_request TEXT NOT NULL, size_request TEXT NOT NULL, "
+            "p_response TEXT NOT NULL, size_response TEXT NOT NULL, "
+            "PRIMARY KEY (key, fid_pair))")
+        self.conn.commit()
+
+    # the alignment result (and which messages are requests) decides all observation probabilities
+    # options: names of the non-default settings that change the probabilities (e.g., the similarity mode),
+    #   the pairs computed with other settings are not reused
+    @staticmethod
+    def compute_key(filepath_output_oneline, filepath_fields_info, direction_list, options=()):
+        sha = hashlib.sha256()
+        for filepath in [filepath_output_oneline, filepath_fields_info]:
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+        sha.update(bytes(int(d) & 0xff for d in direction_list))
+        # without options the key is unchanged, so older checkpoints stay valid
+        for option in options:
+            sha.update(option.encode())
+
+        return sha.hexdigest()
+
+    # output: {fid_pair: [fid_pair, p_request, size_request, p_response, size_response]}
+    def load(self):
+        rows = dict()
+        cursor = self.conn.execute(
+            "SELECT fid_pair, p_request, size_request, p_response, size_response FROM pairs WHERE key = ?", (self.key,))
+        for fid_pair, p_request, size_request, p_response, size_response in cursor:
+            rows[fid_pair] = [fid_pair, json.loads(p_request), json.loads(size_request), json.loads(p_response), json.loads(size_response)]
+        logging.debug("Load {} fid pairs from checkpoint {}".format(len(rows), self.filepath))
+
+        return rows
+
+    # result: list of [fid_pair, p_request, size_request, p_response, size_response]
+    def append(self, result):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?)",
+            [(self.key, fid_pair, json.dumps(p_request), json.dumps(size_request), json.dumps(p_response), json.dumps(size_response))
+             for fid_pair, p_request, size_request, p_response, size_response in result])
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM pairs WHERE key = ?", (self.key,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @classmethod
+    def open_in(cls, output_dir, direction_list, options=()):
+        key = cls.compute_key(os.path.join(output_dir, Alignment.FILENAME_OUTPUT_ONELINE),
+                              os.path.join(output_dir, Alignment.FILENAME_FIELDS_INFO), direction_list, options)
+        return cls(os.path.join(output_dir, CheckpointStore.FILENAME), key)
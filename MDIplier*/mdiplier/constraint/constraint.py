@@ -16,164 +16,365 @@
 
 import os
 import logging
-import copy
-import collections
-import gc
 
-from netzob.Model.Vocabulary.Symbol import Symbol
-from netzob.Model.Vocabulary.Field import Field
-from netzob.Model.Vocabulary.Types.Raw import Raw
+import numpy as np
+
 #from netzob.Import.PCAPImporter.all import *
 #from netzob.Model.Vocabulary.Session import Session
 
 from processing import Processing
 from alignment import Alignment
+from message_store import MessageStore
 from constraint.message_similarity import MessageSimilarity
 from constraint.remote_coupling import RemoteCoupling
+from constraint.field_clusters import FieldClusters
+from constraint.unique_rows import UniqueRows
+from constraint.executor import CandidateExecutor
+from constraint.prescreen import CandidatePrescreen
 
 class Constraint:
     TEST_TYPE_REQUEST = 0
     TEST_TYPE_RESPONSE = 1
+    # fid pairs to compute: only same-field pairs (used by the inference) or the full request x response matrix
+    PAIRS_DIAGONAL = 'diagonal'
+    PAIRS_FULL = 'full'
+    GAP = ord('-')
+    # similarity matrices larger than this are backed by files in output_dir
+    SIMILARITY_MEMMAP_BYTES = 1 << 30
     #FILENAME_P_REQUEST = "prob_request.txt"
     #FILENAME_P_RESPONSE = "prob_response.txt"
 
-    def __init__(self, messages, direction_list, fields, fid_list, output_dir='tmp/'):
+    # checkpoint: CheckpointStore, the computed fid pairs are appended to it and skipped when rerun
+    # top_k: only score the top_k candidates of the statistical prescreen (None: score all candidates)
+    # similarity_samples: estimate p_m from this num of sampled pairs per symbol (None: exact)
+    # validate_sampling: also compute the exact p_m and log the error of the sampled one
+    # similarity_mode: score of message pairs, MessageSimilarity.MODE_COLUMN (equal MSA columns) or MODE_NW (pairwise alignment)
+    # pairing/pairing_window: how responses are paired with requests for p_r (RemoteCoupling.PAIRINGS)
+    def __init__(self, messages, direction_list, layout, fid_list, output_dir='tmp/', store=None, pair_mode=PAIRS_DIAGONAL, workers=1, checkpoint=None, top_k=None,
+                 similarity_samples=None, validate_sampling=False, similarity_mode=MessageSimilarity.MODE_COLUMN,
+                 pairing=RemoteCoupling.PAIRING_SESSION, pairing_window=RemoteCoupling.WINDOW):
+        assert pair_mode in [Constraint.PAIRS_DIAGONAL, Constraint.PAIRS_FULL], "unknown pair_mode: {}".format(pair_mode)
         self.messages = messages
         self.direction_list = direction_list
-        self.fields = fields
+        self.layout = layout
         self.fid_list = fid_list
         self.output_dir = output_dir
-
-    def compute_observation_probabilities(self):
+        self.pair_mode = pair_mode
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.top_k = top_k
+        self.similarity_samples = similarity_samples
+        self.validate_sampling = validate_sampling and similarity_samples is not None
+        self.similarity_mode = similarity_mode
+        self.pairing = pairing
+        self.pairing_window = pairing_window
+        self.prescreen_ranking = None
+        self.constraint_m = None
+        # clusters of each tested field: {direction: {fid: FieldClusters}}
+        self.clusters_cache = {Constraint.TEST_TYPE_REQUEST: dict(), Constraint.TEST_TYPE_RESPONSE: dict()}
+        self.store = store if store is not None else MessageStore.from_messages(messages, direction_list)
+
+    def compute_observation_probabilities(self, fid_pairs=None):
         print("[++++++++] Compute probabilities of observation constraints")
-        messages_aligned = Alignment.get_messages_aligned(self.messages, os.path.join(self.output_dir, Alignment.FILENAME_OUTPUT_ONELINE))
+        filepath_output_oneline = os.path.join(self.output_dir, Alignment.FILENAME_OUTPUT_ONELINE)
+        messages_aligned = Alignment.get_messages_aligned(self.messages, filepath_output_oneline)
         messages_request, messages_response = Processing.divide_msgs_by_directionlist(self.messages, self.direction_list)
         messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(messages_aligned, self.direction_list)
 
-        fid_list_request = self.filter_fields(self.fields, self.fid_list, messages_request_aligned)
-        fid_list_response = self.filter_fields(self.fields, self.fid_list, messages_response_aligned)
+        # aligned messages as n x L matrices of each direction
+        aligned = self.store.load_aligned(filepath_output_oneline)
+        direction = np.asarray(self.direction_list)
+        self.aligned = {Constraint.TEST_TYPE_REQUEST: aligned[direction == 0], Constraint.TEST_TYPE_RESPONSE: aligned[direction != 0]}
+        # repeated messages are clustered and scored once, as distinct rows weighted by their num of messages
+        self.unique_rows = {d: UniqueRows(self.aligned[d]) for d in self.aligned}
+        logging.debug("Distinct aligned rows: {} of {} requests, {} of {} responses".format(
+            len(self.unique_rows[Constraint.TEST_TYPE_REQUEST]), len(self.aligned[Constraint.TEST_TYPE_REQUEST]),
+            len(self.unique_rows[Constraint.TEST_TYPE_RESPONSE]), len(self.aligned[Constraint.TEST_TYPE_RESPONSE])))
+        # gap bitmap and gap count of each distinct row, shared by the structure scores of all fields
+        self.gaps = {d: self.unique_rows[d].rows == Constraint.GAP for d in self.aligned}
+        self.gaps_count = {d: np.count_nonzero(self.gaps[d], axis=1) for d in self.gaps}
+
+        self.messages_aligned = {Constraint.TEST_TYPE_REQUEST: messages_request_aligned, Constraint.TEST_TYPE_RESPONSE: messages_response_aligned}
+        # request/response pairs, shared by the remote coupling of all fields
+        self.session_pairs = RemoteCoupling.get_pairs(self.store, self.direction_list, self.pairing, self.pairing_window)
+
+        fid_list_request = self.filter_fields(self.layout, self.fid_list, messages_request_aligned)
+        fid_list_response = self.filter_fields(self.layout, self.fid_list, messages_response_aligned)
+        # a direction without messages (e.g., a trace of requests only) has no observations, the fields are tested on the other one
+        if len(self.aligned[Constraint.TEST_TYPE_RESPONSE]) == 0:
+            logging.warning("No response messages, the fields are only tested on the requests")
+            fid_list_response = list(fid_list_request)
+        elif len(self.aligned[Constraint.TEST_TYPE_REQUEST]) == 0:
+            logging.warning("No request messages, the fields are only tested on the responses")
+            fid_list_request = list(fid_list_response)
         logging.debug("request candidate fid: {}\nresponse candidate fid: {}".format(fid_list_request, fid_list_response))
 
-        # compute matrix of similarity scores
-        constraint_m_request, constraint_m_response = MessageSimilarity(messages = messages_request_aligned), MessageSimilarity(messages = messages_response_aligned)
-        constraint_m_request.compute_similarity_matrix()
-        constraint_m_response.compute_similarity_matrix()
-        
-        # the observation prob of each cluster: {fid: the list of observation probabilities ([pm,ps,pd,pv])} 
-        cluster_p_request, cluster_p_response = dict(), dict() 
-        # the size of each cluster
-        cluster_size_request, cluster_size_response = dict(), dict()
+        if self.top_k is not None:
+            fid_list_request, fid_list_response = self.prescreen_fields(fid_list_request, fid_list_response)
+            logging.debug("request prescreened fid: {}\nresponse prescreened fid: {}".format(fid_list_request, fid_list_response))
+
+        # only compute the requested pairs
+        fid_pairs = self.get_fid_pairs(fid_list_request, fid_list_response, fid_pairs)
+        logging.debug("Number of fid pairs: {}".format(len(fid_pairs)))
+
+        return self.evaluate_fid_pairs(fid_pairs)
+
+    # compute the observation probabilities of the fid pairs (a fid is a field id or a tuple of field ids)
+    # it can be called again after compute_observation_probabilities (e.g., for composite keywords)
+    def evaluate_fid_pairs(self, fid_pairs):
+        # skip the pairs already stored by a previous (interrupted) run
+        # validate_sampling compares the sampled and exact p_m of each pair, so nothing is resumed (the pairs are still stored)
+        results = list()
+        if self.checkpoint is not None and not self.validate_sampling:
+            stored = self.checkpoint.load()
+            results.append([stored[fid_pair] for fid_pair in [self.get_fid_pair_name(*pair) for pair in fid_pairs] if fid_pair in stored])
+            fid_pairs = [pair for pair in fid_pairs if self.get_fid_pair_name(*pair) not in stored]
+            logging.info("[++++] Resume from checkpoint: {} fid pairs stored, {} to compute".format(len(results[0]), len(fid_pairs)))
+
+        # each task: a request fid and its response fids
+        tasks = list()
+        for fid_request in dict.fromkeys(fid for fid, _ in fid_pairs):
+            fid_list_response_requested = [fid_response for fid, fid_response in fid_pairs if fid == fid_request]
+            tasks.append((fid_request, fid_list_response_requested))
+
+        if len(tasks) > 0:
+            results.extend(self.evaluate_tasks(tasks))
+
         # the observation prob of each cluster pair: {fid-fid: [,]}
         pairs_p_request, pairs_p_response = dict(), dict()
         pairs_size_request, pairs_size_response = dict(), dict()
+        for result in results:
+            for fid_pair, p_request, size_request, p_response, size_response in result:
+                pairs_p_request[fid_pair] = p_request
+                pairs_size_request[fid_pair] = size_request
+                pairs_p_response[fid_pair] = p_response
+                pairs_size_response[fid_pair] = size_response
 
-        for fid_request in fid_list_request:
-            logging.info("[++++] Test Request Field {0}-*".format(fid_request))
+        pairs_p = [pairs_p_request, pairs_p_response]
+        pairs_size = [pairs_size_request, pairs_size_response]
 
-            # merge other fields
-            fields_merged_request = self.merge_nontest_fields(self.fields, fid_request)
-            fid_merged_request = 0 if fid_request == 0 else 1
+        return pairs_p, pairs_size
 
-            # generate clusters
-            symbols_request_aligned = self.cluster_by_field(fields_merged_request, messages_request_aligned, fid_merged_request)
-            # change symbol names
-            symbols_request_aligned = self.change_symbol_name(symbols_request_aligned)
+    # compute matrix of similarity scores, only once (and only if some pair is not checkpointed)
+    def prepare_evaluation(self):
+        if self.constraint_m is not None:
+            return
+        self.constraint_m, self.constraint_m_exact = dict(), dict()
+        for direction, filename in [(Constraint.TEST_TYPE_REQUEST, "similarity_request.bin"), (Constraint.TEST_TYPE_RESPONSE, "similarity_response.bin")]:
+            num = len(self.unique_rows[direction])
+            if num == 0:
+                self.constraint_m[direction] = None
+                continue
+            # condensed uint16 counts: 2 bytes per pair
+            filepath = os.path.join(self.output_dir, filename) if num * (num - 1) > Constraint.SIMILARITY_MEMMAP_BYTES else None
+            constraint_m = MessageSimilarity(messages = self.messages_aligned[direction], aligned = self.unique_rows[direction].rows, filepath = filepath, num_samples = self.similarity_samples, mode = self.similarity_mode)
+            constraint_m.compute_similarity_matrix()
+            self.constraint_m[direction] = constraint_m
+
+            if self.validate_sampling:
+                constraint_m_exact = MessageSimilarity(messages = self.messages_aligned[direction], aligned = self.unique_rows[direction].rows, filepath = filepath, mode = self.similarity_mode)
+                constraint_m_exact.compute_similarity_matrix()
+                self.constraint_m_exact[direction] = constraint_m_exact
+
+        # the observation prob of each cluster: {fid: the list of observation probabilities ([pm,ps,pd,pv])}
+        self.cluster_p = {Constraint.TEST_TYPE_REQUEST: dict(), Constraint.TEST_TYPE_RESPONSE: dict()}
+        # the size of each cluster
+        self.cluster_size = {Constraint.TEST_TYPE_REQUEST: dict(), Constraint.TEST_TYPE_RESPONSE: dict()}
 
-            # compute prob of m,s,d,v
-            cluster_p_request[fid_request] = list()
-            cluster_p_request[fid_request].append(constraint_m_request.compute_constraint_message_similarity(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_structure(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_dimension(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_value(symbols_request_aligned))
-            cluster_size_request[fid_request] = [len(s.messages) for s in symbols_request_aligned.values()]
-
-            for fid_response in fid_list_response:
-                #if fid_request != fid_response:
-                #    continue
-                logging.debug("[++] Test Response Field {0}-{1}".format(fid_request, fid_response))
-
-                # merge other fields
-                fields_merged_response = self.merge_nontest_fields(self.fields, fid_response)
-                fid_merged_response = 0 if fid_response == 0 else 1
-
-                # generate clusters
-                symbols_response_aligned = self.cluster_by_field(fields_merged_response, messages_response_aligned, fid_merged_response)
-                # change symbol names
-                symbols_response_aligned = self.change_symbol_name(symbols_response_aligned)
-
-                # compute prob of m,s,d,v
-                if fid_response not in cluster_p_response:
-                    cluster_p_response[fid_response] = list()
-                    cluster_p_response[fid_response].append(constraint_m_response.compute_constraint_message_similarity(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_structure(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_dimension(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_value(symbols_response_aligned))
-                    cluster_size_response[fid_response] = [len(s.messages) for s in symbols_response_aligned.values()]
-
-                # print msg numbers of each cluster
-                logging.debug("Number of request symbols: {0}".format(len(symbols_request_aligned.values())))
-                for s in symbols_request_aligned.values():
-                    logging.debug("  Symbol {0} msgs numbers: {1}".format(str(s.name), len(s.messages)))
-                logging.debug("Number of response symbols: {0}".format(len(symbols_response_aligned.values())))
-                for s in symbols_response_aligned.values():
-                    logging.debug("  Symbol {0} msgs numbers: {1}".format(str(s.name), len(s.messages)))
-
-                # compute remote coupling probabilities
-                rc = RemoteCoupling(messages_all=messages_aligned, symbols_request=symbols_request_aligned, symbols_response=symbols_response_aligned, direction_list=self.direction_list)
-                rc.compute_pairs_by_directionlist()
-                fid_pair = "{}-{}".format(fid_request, fid_response)
-                p_r_request = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_REQUEST)
-                p_r_response = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_RESPONSE)
-
-                logging.debug("[+] Observation Prob Results for pairs {}".format(fid_pair))
-                p_m, p_s, p_d, p_v = cluster_p_request[fid_request][0], cluster_p_request[fid_request][1], cluster_p_request[fid_request][2], cluster_p_request[fid_request][3]
-                logging.debug("Request:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_request, p_s, p_d, p_v))
-                pairs_p_request[fid_pair] = [p_m, p_r_request, p_s, p_d, p_v]
-                pairs_size_request[fid_pair] = cluster_size_request[fid_request]
-                
-                p_m, p_s, p_d, p_v = cluster_p_response[fid_response][0], cluster_p_response[fid_response][1], cluster_p_response[fid_response][2], cluster_p_response[fid_response][3]
-                logging.debug("Response:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_response, p_s, p_d, p_v))
-                pairs_p_response[fid_pair] = [p_m, p_r_response, p_s, p_d, p_v]
-                pairs_size_response[fid_pair] = cluster_size_response[fid_response]
-                
-                del rc
-                del symbols_response_aligned #symbols
-                del fields_merged_response
-                gc.collect()
-            del symbols_request_aligned
-            del fields_merged_request
-            gc.collect()
+    # compute the observation probabilities of the tasks, serially or in worker processes
+    def evaluate_tasks(self, tasks):
+        self.prepare_evaluation()
 
-        pairs_p = [pairs_p_request, pairs_p_response]
-        pairs_size = [pairs_size_request, pairs_size_response]
+        on_result = self.checkpoint.append if self.checkpoint is not None else None
+        if self.workers > 1 and len(tasks) > 1 and CandidateExecutor.is_available():
+            logging.info("[++++] Evaluate {} candidates with {} workers".format(len(tasks), self.workers))
+            results = CandidateExecutor(self, self.workers).execute(tasks, on_result=on_result)
+        else:
+            if self.workers > 1:
+                logging.warning("Parallel evaluation is not available, evaluate candidates serially")
+            results = list()
+            for fid_request, fid_list_response_requested in tasks:
+                result = self.evaluate_fid_request(fid_request, fid_list_response_requested)
+                if on_result is not None:
+                    on_result(result)
+                results.append(result)
+
+        return results
+
+    # the direction the keyword is inferred from: the requests, or the responses if there is no request
+    def get_inference_direction(self):
+        if len(self.aligned[Constraint.TEST_TYPE_REQUEST]) == 0:
+            return Constraint.TEST_TYPE_RESPONSE
+        return Constraint.TEST_TYPE_REQUEST
+
+    # rank the candidates by cheap statistics of their clusters and keep the top_k
+    def prescreen_fields(self, fid_list_request, fid_list_response):
+        print("[++++++++] Prescreen keyword candidates")
+        labels = dict()
+        for fid in sorted(set(fid_list_request) | set(fid_list_response)):
+            labels[fid] = [self.get_clusters(Constraint.TEST_TYPE_REQUEST, fid).labels if fid in fid_list_request else None,
+                           self.get_clusters(Constraint.TEST_TYPE_RESPONSE, fid).labels if fid in fid_list_response else None]
+
+        scores = CandidatePrescreen(*self.session_pairs).compute_scores(labels)
+        self.prescreen_ranking = CandidatePrescreen.rank(scores)
+        CandidatePrescreen.save_ranking(scores, self.prescreen_ranking, self.output_dir)
+
+        fids_kept = set(self.prescreen_ranking[:self.top_k])
+        logging.info("[++++] Prescreen keeps {} of {} candidates".format(len(fids_kept), len(self.prescreen_ranking)))
+
+        return [fid for fid in fid_list_request if fid in fids_kept], [fid for fid in fid_list_response if fid in fids_kept]
+
+    # labels_true: the true keyword of each request message (Clustering.cluster_by_kw_true)
+    def report_prescreen_recall(self, labels_true):
+        if self.prescreen_ranking is None or len(labels_true) == 0:
+            return None
+        labels = {fid: self.clusters_cache[Constraint.TEST_TYPE_REQUEST][fid].labels
+                  for fid in self.prescreen_ranking if fid in self.clusters_cache[Constraint.TEST_TYPE_REQUEST]}
+
+        return CandidatePrescreen.report_recall(self.prescreen_ranking, self.top_k, labels_true, labels)
+
+    # compute the observation probabilities of the pairs fid_request-fid_response
+    # output: list of [fid_pair, p_request, size_request, p_response, size_response]
+    def evaluate_fid_request(self, fid_request, fid_list_response):
+        logging.info("[++++] Test Request Field {0}-*".format(fid_request))
+        cluster_p_request, cluster_p_response = self.cluster_p[Constraint.TEST_TYPE_REQUEST], self.cluster_p[Constraint.TEST_TYPE_RESPONSE]
+        cluster_size_request, cluster_size_response = self.cluster_size[Constraint.TEST_TYPE_REQUEST], self.cluster_size[Constraint.TEST_TYPE_RESPONSE]
+        results = list()
+
+        # generate clusters (cached for each direction and fid)
+        clusters_request = self.get_clusters(Constraint.TEST_TYPE_REQUEST, fid_request)
+
+        # compute prob of m,s,d,v
+        if fid_request not in cluster_p_request:
+            cluster_p_request[fid_request] = self.compute_cluster_probabilities(Constraint.TEST_TYPE_REQUEST, clusters_request)
+            cluster_size_request[fid_request] = clusters_request.sizes.tolist()
+
+        for fid_response in fid_list_response:
+            logging.debug("[++] Test Response Field {0}-{1}".format(fid_request, fid_response))
+
+            # generate clusters (cached for each direction and fid)
+            clusters_response = self.get_clusters(Constraint.TEST_TYPE_RESPONSE, fid_response)
 
-        return pairs_p, pairs_size
+            # compute prob of m,s,d,v
+            if fid_response not in cluster_p_response:
+                cluster_p_response[fid_response] = self.compute_cluster_probabilities(Constraint.TEST_TYPE_RESPONSE, clusters_response)
+                cluster_size_response[fid_response] = clusters_response.sizes.tolist()
+
+            # print msg numbers of each cluster
+            logging.debug("Number of request symbols: {0}".format(len(clusters_request)))
+            for sn, size in zip(clusters_request.names, clusters_request.sizes):
+                logging.debug("  Symbol {0} msgs numbers: {1}".format(sn, size))
+            logging.debug("Number of response symbols: {0}".format(len(clusters_response)))
+            for sn, size in zip(clusters_response.names, clusters_response.sizes):
+                logging.debug("  Symbol {0} msgs numbers: {1}".format(sn, size))
+
+            # compute remote coupling probabilities
+            rc = RemoteCoupling(clusters_request=clusters_request, clusters_response=clusters_response, session_pairs=self.session_pairs)
+            rc.compute_pairs_by_directionlist()
+            fid_pair = self.get_fid_pair_name(fid_request, fid_response)
+            p_r_request = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_REQUEST)
+            p_r_response = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_RESPONSE)
+
+            logging.debug("[+] Observation Prob Results for pairs {}".format(fid_pair))
+            p_m, p_s, p_d, p_v = cluster_p_request[fid_request][0], cluster_p_request[fid_request][1], cluster_p_request[fid_request][2], cluster_p_request[fid_request][3]
+            logging.debug("Request:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_request, p_s, p_d, p_v))
+            p_request = [p_m, p_r_request, p_s, p_d, p_v]
+
+            p_m, p_s, p_d, p_v = cluster_p_response[fid_response][0], cluster_p_response[fid_response][1], cluster_p_response[fid_response][2], cluster_p_response[fid_response][3]
+            logging.debug("Response:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_response, p_s, p_d, p_v))
+            p_response = [p_m, p_r_response, p_s, p_d, p_v]
+
+            results.append([fid_pair, p_request, cluster_size_request[fid_request], p_response, cluster_size_response[fid_response]])
+
+        return results
+
+    # cluster the messages of one direction by the field fid, only once for each (direction, fid)
+    # labels: the index of the symbol of each message
+    def get_clusters(self, direction, fid):
+        if fid not in self.clusters_cache[direction]:
+            self.clusters_cache[direction][fid] = self.cluster_by_field(self.layout, fid, self.unique_rows[direction])
+
+        return self.clusters_cache[direction][fid]
+
+    # compute prob of m,s,d,v of each cluster (no probabilities if the direction has no messages)
+    def compute_cluster_probabilities(self, direction, clusters):
+        cluster_p = list()
+        if len(clusters) == 0:
+            return [list(), list(), list(), list()]
+        cluster_p.append(self.constraint_m[direction].compute_constraint_message_similarity(clusters))
+        if self.similarity_samples is not None:
+            self.log_sampled_similarity(direction, clusters, cluster_p[0])
+        cluster_p.append(self.compute_constraint_structure(clusters, self.gaps[direction], self.gaps_count[direction]))
+        cluster_p.append(self.compute_constraint_dimension(clusters))
+        cluster_p.append(self.compute_constraint_value(clusters))
+
+        return cluster_p
+
+    # name of a fid: "3", or "3+5" for a composite keyword (a tuple of fids)
+    @staticmethod
+    def get_fid_name(fid):
+        if isinstance(fid, tuple):
+            return "+".join(str(f) for f in fid)
+        return str(fid)
+
+    @staticmethod
+    def get_fid_pair_name(fid_request, fid_response):
+        return "{}-{}".format(Constraint.get_fid_name(fid_request), Constraint.get_fid_name(fid_response))
+
+    # output: the field ids of a fid name ("3+5" -> [3, 5])
+    @staticmethod
+    def parse_fid_name(fid_name):
+        return [int(f) for f in fid_name.split("+")]
+
+    # fid_pairs: explicit list of (fid_request, fid_response); by default it is decided by pair_mode
+    def get_fid_pairs(self, fid_list_request, fid_list_response, fid_pairs=None):
+        if fid_pairs is None:
+            if self.pair_mode == Constraint.PAIRS_FULL:
+                fid_pairs = [(fid_request, fid_response) for fid_request in fid_list_request for fid_response in fid_list_response]
+            else:
+                fid_pairs = [(fid, fid) for fid in fid_list_request if fid in fid_list_response]
+        else:
+            fid_pairs = [(fid_request, fid_response) for fid_request, fid_response in fid_pairs
+                         if fid_request in fid_list_request and fid_response in fid_list_response]
+
+        return fid_pairs
 
     def save_observation_probabilities(self, pairs_p, pairs_size, direction):
         filename = "prob_request.txt" if direction == Constraint.TEST_TYPE_REQUEST else "prob_response.txt"
         filepath = os.path.join(self.output_dir, filename)
         
-        fid_pair_list = sorted(pairs_p.keys(), key= lambda x: (int(x.split('-')[direction]), int(x.split('-')[1 - direction])))
+        fid_pair_list = sorted(pairs_p.keys(), key= lambda x: (self.parse_fid_name(x.split('-')[direction]), self.parse_fid_name(x.split('-')[1 - direction])))
         # Write into files
         with open(filepath, 'w') as fout:
             for fid_pair in fid_pair_list:
                 fout.write("{} ".format(fid_pair))
 
-                # write Pm/r/s/d/v
+                # write Pm/r/s/d/v ("-": no observation, the direction has no messages)
                 for p_list in pairs_p[fid_pair]:
-                    for p in p_list[:-1]:
-                        fout.write("{},".format(p))
-                    fout.write("{} ".format(p_list[-1]))
+                    fout.write("{} ".format(",".join(str(p) for p in p_list) if p_list else "-"))
 
-                for n in pairs_size[fid_pair][:-1]:
-                    fout.write("{},".format(n))
-                fout.write("{} ".format(pairs_size[fid_pair][-1]))
+                fout.write("{} ".format(",".join(str(n) for n in pairs_size[fid_pair]) if pairs_size[fid_pair] else "-"))
                 fout.write("\n")
 
     # read probabilities from file
     def load_observation_probabilities(self, direction):
         filename = "prob_request.txt" if direction == Constraint.TEST_TYPE_REQUEST else "prob_response.txt"
-        filepath = os.path.join(self.output_dir, filename)
+        return Constraint.read_observation_probabilities(os.path.join(self.output_dir, filename))
+
+    # the saved probabilities of the direction the keyword is inferred from (get_inference_direction):
+    # the requests, or the responses if there is no request (all the request observations are empty)
+    # output: direction, pairs_p, pairs_size
+    @staticmethod
+    def read_inference_probabilities(output_dir):
+        pairs_p, pairs_size = Constraint.read_observation_probabilities(os.path.join(output_dir, "prob_request.txt"))
+        if len(pairs_size) > 0 and not any(pairs_size.values()):
+            pairs_p, pairs_size = Constraint.read_observation_probabilities(os.path.join(output_dir, "prob_response.txt"))
+            return Constraint.TEST_TYPE_RESPONSE, pairs_p, pairs_size
+        return Constraint.TEST_TYPE_REQUEST, pairs_p, pairs_size
+
+    # the file of save_observation_probabilities, output: pairs_p, pairs_size
+    @staticmethod
+    def read_observation_probabilities(filepath):
         assert os.path.exists(filepath), "File {0} doesn't exist".format(filepath)
         
         pairs_p, pairs_size = dict(), dict()
@@ -185,62 +386,68 @@ class Constraint:
                 #fid_response = int(fid_list.split(",")[1])
                 pairs_p[fid_pair] = list()
                 for p_list in line.split()[1:-1]:
-                    p_values = [float(p) for p in p_list.split(",")]
+                    p_values = [float(p) for p in p_list.split(",")] if p_list != "-" else list()
                     pairs_p[fid_pair].append(p_values)
-                pairs_size[fid_pair] = [int(n) for n in line.split()[-1].split(",")]
+                pairs_size[fid_pair] = [int(n) for n in line.split()[-1].split(",")] if line.split()[-1] != "-" else list()
                 #print("fid {}: {}".format(fid, dict_sn_msgnum[fid]))
 
         return pairs_p, pairs_size
 
+    # confidence intervals of the sampled p_m, and its error against the exact p_m (validate_sampling)
+    def log_sampled_similarity(self, direction, clusters, p_m):
+        confidence_intervals = self.constraint_m[direction].confidence_intervals
+        widths = [high - low for low, high in confidence_intervals.values()]
+        logging.debug("Sampled p_m confidence intervals: {}".format(confidence_intervals))
+        if not self.validate_sampling:
+            logging.info("[sampling] max width of the p_m confidence intervals: {:.4f}".format(max(widths, default=0.0)))
+            return
+
+        p_m_exact = self.constraint_m_exact[direction].compute_constraint_message_similarity(clusters)
+        errors = [abs(p - p_exact) for p, p_exact in zip(p_m, p_m_exact)]
+        num_covered = sum(1 for sn, p_exact in zip(clusters.names, p_m_exact)
+                          if confidence_intervals[sn][0] <= p_exact <= confidence_intervals[sn][1] or p_exact < 0)
+        logging.info("[sampling] max |p_m - exact|: {:.4f}, mean: {:.4f}, exact p_m within the interval: {}/{}, max interval width: {:.4f}".format(
+            max(errors, default=0.0), float(np.mean(errors)) if errors else 0.0, num_covered, len(p_m_exact), max(widths, default=0.0)))
+
     # compute p_s
     # TODO: provide another method to align each cluster again
-    def compute_constraint_structure(self, symbols):
+    # gaps: u x L gap bitmap of the distinct rows, gaps_count: the num of gaps of each row
+    # all clusters are reduced at once: rows are grouped by cluster, weighted by their num of messages and summed with reduceat
+    def compute_constraint_structure(self, clusters, gaps, gaps_count):
         logging.debug("[+] Compute observation probabilities of structure coherence")
-        sn_list = [str(s.name) for s in symbols.values()]
-
-        # if there is ony one msg, then it is always 1.0
-        dict_result = dict() 
-        for s in symbols.values():
-            # compute the num of gaps shared by all msgs
-            num_gap_extra = 0
-            for i in range(len(s.messages[0].data)):
-                valuelist = [message.data[i] for message in s.messages]
-                if len(set(valuelist)) == 1 and valuelist[0] == '-':
-                    num_gap_extra += 1
-            #print("Num Extra Gaps: {}".format(num_gap_extra))
-            
-            # compute ave num of gaps
-            num_gap = 0 
-            for message in s.messages:
-                num_gap += (message.data.count("-") - num_gap_extra)
-
-            num_gap_ave = num_gap / len(s.messages)
-            percentage_gap = num_gap_ave / (len(s.messages[0].data) - num_gap_extra)
-            dict_result[s.name] = [1 - percentage_gap, num_gap_ave]
-
-        p_s = list()
-        for s in sn_list:
-            p_s.append(dict_result[s][0])
+
+        sizes = clusters.sizes
+        weights = clusters.row_weights
+        order = np.concatenate(clusters.row_indices)
+        starts = np.concatenate(([0], np.cumsum([len(indices) for indices in clusters.row_indices])[:-1]))
+        # num of gaps in each column of each cluster (k x L)
+        gaps_cluster = np.add.reduceat(gaps[order] * weights[order, None].astype(np.int32), starts, axis=0, dtype=np.int32)
+
+        # compute the num of gaps shared by all msgs
+        num_gap_extra = np.count_nonzero(gaps_cluster == sizes[:, None], axis=1)
+
+        # compute ave num of gaps (if there is ony one msg, then it is always 1.0)
+        num_gap = np.bincount(clusters.row_labels, weights=gaps_count * weights, minlength=len(clusters)) - num_gap_extra * sizes
+        num_gap_ave = num_gap / sizes
+        percentage_gap = num_gap_ave / (gaps.shape[1] - num_gap_extra)
+        p_s = (1 - percentage_gap).tolist()
 
         return p_s
 
     # compute p_d
-    def compute_constraint_dimension(self, symbols):
+    def compute_constraint_dimension(self, clusters):
         logging.debug("[+] Compute observation probabilities of dimension")
-        num_smallsymbols = 0
-        for s in symbols.values():
-            if len(s.messages) <= 2:
-                num_smallsymbols += 1
+        num_smallsymbols = int(np.count_nonzero(clusters.sizes <= 2))
 
-        p = 1 - num_smallsymbols / len(symbols.values())
+        p = 1 - num_smallsymbols / len(clusters)
         p_d = [p]
 
         return p_d
 
     # compute p_v
-    def compute_constraint_value(self, symbols):
+    def compute_constraint_value(self, clusters):
         # TODO: may not need it
-        if len(symbols.values()) == 1:
+        if len(clusters) == 1:
             p = -1
         else:
             p = 1
@@ -251,19 +458,18 @@ class Constraint:
     """ Processing Func
     """
     # eliminate impossible fileds
-    def filter_fields(self, fields, fid_list, messages):
+    def filter_fields(self, layout, fid_list, messages):
         logging.debug("[++++] Filter Fields")
         fid_list_new = list()
+        if len(messages) == 0:
+            return fid_list_new
         for fid in fid_list:
             logging.debug("\n[+] Test Field_{0}".format(fid))
 
-            il, ir = 0, 0
-            for i in range(fid):
-                il += fields[i].domain.dataType.size[1] // 8
-            ir = il + (fields[fid].domain.dataType.size[1] // 8)
+            il, ir = layout.slice(fid)
 
             # -1: the test field is too long
-            if (fields[fid].domain.dataType.size[1] // 8) > 10:
+            if layout.size(fid) > 10:
                 logging.debug("The tested field is too long.")
                 continue
 
@@ -293,78 +499,30 @@ class Constraint:
                 return True
         return False
 
-    # merge other fields that are not tested in this run
-    def merge_nontest_fields(self, fields_origin, fid):
-        logging.debug("[+] Merge Fields")
-        fields_merged = list()
-        fields = copy.deepcopy(fields_origin)
-        fsize_total = 0
-        for i in range(len(fields)):
-            typename = fields[i].domain.dataType.typeName
-            if typename != "Raw":
-                logging.error("Field type is not Raw")
-            typesize = fields[i].domain.dataType.size[1]
-            # print(i, fid, typesize, type(typesize))
-
-            if i == fid:
-                if fsize_total > 0:
-                    field = Field(Raw(nbBytes=fsize_total//8))
-                    fields_merged.append(field)
-                    fsize_total = 0
-                if fid != (len(fields) - 1):    
-                    field = Field(Raw(nbBytes=typesize//8))
-                    fields_merged.append(field)
-                    field = Field()
-                    fields_merged.append(field)
-                else:
-                    if type(typesize).__name__ == 'NoneType':
-                        field = Field()
-                    else:
-                        field = Field(Raw(nbBytes=typesize//8))
-                    fields_merged.append(field)
-                break
-            else:
-                fsize_total += typesize         
-
-        return fields_merged
-
-    def cluster_by_field(self, fields, messages, fid_merged):
+    # unique_rows: UniqueRows of the aligned messages, only the distinct rows are labelled
+    # fid: a field id, or a tuple of field ids (composite keyword, clustered by the values of all its fields)
+    def cluster_by_field(self, layout, fid, unique_rows):
         logging.debug("[+] Generate Clusters")
-        if fid_merged == 0:
-            il = 0
-            ir = fields[0].domain.dataType.size[1] // 8
-        elif fid_merged == 1:
-            il =fields[0].domain.dataType.size[1] // 8
-            ir = il + (fields[1].domain.dataType.size[1] // 8)
+        aligned = unique_rows.rows
+        if isinstance(fid, tuple):
+            columns = np.concatenate([np.arange(*layout.slice(f)) for f in fid])
+            labels, f_values = self.get_field_labels(aligned[:, columns], 0, len(columns))
         else:
-            logging.error("Error: fid_merged should be 0 or 1")
-
-        f_values = [message.data[il:ir] for message in messages]
-
-        dict_fv_i = dict()
-        for i,fv in enumerate(f_values):
-            if fv not in dict_fv_i:
-                dict_fv_i[fv] = list()
-            dict_fv_i[fv].append(i)
-
-        symbols = collections.OrderedDict()
-        for fv in dict_fv_i:
-            s = Symbol(name=fv, messages=[messages[i] for i in dict_fv_i[fv]])
-            symbols[fv] = s
-
-        return symbols
-
-    def change_symbol_name(self, symbols):
-        logging.debug("[+] Change symbol names")
-        for keyFieldName, symbol in symbols.items():
-            if type(keyFieldName).__name__ == "bytes":
-                keyFieldName = binascii.unhexlify(keyFieldName)
-                keyFieldName = keyFieldName.hex()
-                symbol.name = str(keyFieldName)
-            else:
-                symbol.name = keyFieldName
-            if len(symbol.name) > 40:
-                md5 = hashlib.md5()
-                md5.update(symbol.name.encode('utf-8'))
-                symbol.name = str(md5.hexdigest())
-        return symbols
+            il, ir = layout.slice(fid)
+            labels, f_values = self.get_field_labels(aligned, il, ir)
+
+        return FieldClusters(labels, f_values, unique_rows)
+
+    # label each message by the value of aligned[:, il:ir], labels are numbered by first appearance
+    @staticmethod
+    def get_field_labels(aligned, il, ir):
+        values = np.ascontiguousarray(aligned[:, il:ir]).view(np.dtype((np.void, ir - il))).ravel()
+        values_unique, index_first, inverse = np.unique(values, return_index=True, return_inverse=True)
+
+        order = np.argsort(index_first)
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        labels = rank[inverse.reshape(-1)]
+        f_values = [values_unique[k].tobytes().decode('ascii') for k in order]
+
+        return labels, f_values
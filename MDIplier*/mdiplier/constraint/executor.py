@@ -0,0 +1,45 @@
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# state of each worker process, set by the initializer
+_worker_context = dict()
+
+class CandidateExecutor:
+    """Evaluate the candidate fields in worker processes
+
+    The workers are forked from the parent, so they inherit the Constraint object (messages, layout, ...)
+    and its matrices (aligned messages, gap bitmaps and similarity scores) copy-on-write, without copying them.
+    Each task evaluates one request fid with all its response fids; results are returned in the order of the tasks.
+    """
+
+    def __init__(self, constraint, workers):
+        self.constraint = constraint
+        self.workers = workers
+
+    # ProcessPoolExecutor takes initializer and mp_context since python 3.7
+    @staticmethod
+    def is_available():
+        return sys.version_info >= (3, 7) and 'fork' in multiprocessing.get_all_start_methods()
+
+    # on_result: called in the parent process with the result of each task, as soon as it is available
+    def execute(self, tasks, on_result=None):
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(self.constraint,)) as executor:
+            results = list()
+            for result in executor.map(_evaluate_task, tasks):
+                if on_result is not None:
+                    on_result(result)
+                results.append(result)
+
+        return results
+
+def _init_worker(constraint):
+    _worker_context['constraint'] = constraint
+    logging.debug("Worker forked for the candidate evaluation")
+
+def _evaluate_task(task):
+    fid_request, fid_list_response = task
+    return _worker_context['constraint'].evaluate_fid_request(fid_request, fid_list_response)
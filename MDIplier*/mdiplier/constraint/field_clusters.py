@@ -0,0 +1,51 @@
+import hashlib
+
+import numpy as np
+
+class FieldClusters:
+    """Clusters of the messages of one direction by the value of a tested field
+
+    labels:  the cluster index of each message
+    names:   the symbol name of each cluster (the field value)
+    indices: the message indices of each cluster
+    sizes:   the number of messages of each cluster
+    rows, row_labels, row_indices, row_weights: the distinct aligned row of each message (UniqueRows),
+             and the cluster index, the row indices of each cluster and the num of messages of each row
+    """
+    MAX_LEN_NAME = 40
+
+    # unique_rows: UniqueRows of the messages, labels are then the labels of its rows (None: labels of the messages)
+    def __init__(self, labels, names, unique_rows=None):
+        if unique_rows is None:
+            self.rows = np.arange(len(labels))
+            self.row_weights = np.ones(len(labels), dtype=np.int64)
+        else:
+            self.rows = unique_rows.inverse
+            self.row_weights = unique_rows.weights
+        self.row_labels = labels
+        self.labels = labels[self.rows]
+        self.names = [FieldClusters.get_symbol_name(name) for name in names]
+        self.sizes = np.bincount(self.row_labels, weights=self.row_weights, minlength=len(names)).astype(np.int64)
+
+        self.indices = self.split(self.labels, self.sizes)
+        self.row_indices = self.split(self.row_labels, np.bincount(self.row_labels, minlength=len(names)))
+
+    def __len__(self):
+        return len(self.names)
+
+    # the indices of each label
+    @staticmethod
+    def split(labels, counts):
+        order = np.argsort(labels, kind='stable')
+        return np.split(order, np.cumsum(counts)[:-1])
+
+    @staticmethod
+    def get_symbol_name(name):
+        if isinstance(name, bytes):
+            name = name.hex()
+        name = str(name)
+        if len(name) > FieldClusters.MAX_LEN_NAME:
+            md5 = hashlib.md5()
+            md5.update(name.encode('utf-8'))
+            name = str(md5.hexdigest())
+        return name
@@ -16,47 +16,139 @@
 
 import logging
 
+import numpy as np
+
+from constraint.similarity_matrix import SimilarityMatrix
+from constraint.needleman_wunsch import NeedlemanWunsch
+
 class MessageSimilarity:
+    # max size (bytes) of the temporary arrays of one block of the similarity matrix
+    BLOCK_BYTES = 1 << 26
+    GAP = ord('-')
+    # score of a pair: equal columns of the MSA, or matches of a pairwise NW alignment (divided by the MSA length)
+    MODE_COLUMN = 'column'
+    MODE_NW = 'nw'
+    MODES = [MODE_COLUMN, MODE_NW]
+    # NW mode: pairs aligned in one batch
+    NW_BATCH_SIZE = 4096
+    # sampled mode: bootstrap resamples and level of the confidence intervals of p_m
+    NUM_BOOTSTRAP = 100
+    CONFIDENCE = 0.95
 
-    def __init__(self, messages):
+    # aligned: n x L matrix (uint8) of the aligned messages, built from messages if it is not given
+    #   (or the distinct rows of UniqueRows, the pairs are then weighted by FieldClusters.row_weights)
+    # filepath: back the similarity matrix by a file (np.memmap) instead of memory
+    # num_samples: sampled mode, the inner/inter scores of each symbol are estimated from num_samples random pairs
+    #   (no similarity matrix); symbols with fewer pairs are computed exactly
+    def __init__(self, messages, aligned=None, filepath=None, num_samples=None, seed=0, mode=MODE_COLUMN):
+        assert mode in MessageSimilarity.MODES, "unknown similarity mode: {}".format(mode)
         self.messages = messages
-        self.similarity_matrix = list()
+        self.mode = mode
+        # NW mode: the messages without the gaps of the MSA, padded once (NeedlemanWunsch.pad)
+        self.sequences = None
+        self.aligned = aligned if aligned is not None else self.get_aligned_matrix(messages)
+        self.filepath = filepath
+        self.num_samples = num_samples
+        self.seed = seed
+        self.length = max(self.aligned.shape[1], 1)
+        self.similarity_matrix = None
+        # sampled mode: {symbol_name: (low, high)} of the last computed p_m
+        self.confidence_intervals = dict()
+
+    @staticmethod
+    def get_aligned_matrix(messages):
+        datas = [message.data.encode('ascii') if isinstance(message.data, str) else bytes(message.data) for message in messages]
+        length = max(len(data) for data in datas) if datas else 0
+        if any(len(data) != length for data in datas):
+            logging.warning("The compared messages don't have the same length, pad them with gaps")
+            datas = [data.ljust(length, bytes([MessageSimilarity.GAP])) for data in datas]
+        return np.frombuffer(b''.join(datas), dtype=np.uint8).reshape(len(datas), length)
 
+    # use the MSA result is quick, but less accurate
+    # score: the proportion of equal columns of two aligned messages
     def compute_similarity_matrix(self):
+        if self.num_samples is not None:
+            logging.info("[++++] Sampled similarity: {} pairs per symbol, no similarity matrix".format(self.num_samples))
+            return
         print("[++++] Compute matrix of similarity scores")
-        scoreslist = list()
-        for i in range(len(self.messages)):
-            initial_scores_list = [-1 for i in range(len(self.messages))]
-            scoreslist.append(initial_scores_list)
-
-        # use the MSA result is quick, but less accurate
-        for i in range(len(self.messages)):
-            for j in range(i, len(self.messages)):
-                if j == i:
-                    score = 100.0
-                    scoreslist[i][j] = score
-                else:
-                    score = self.compute_similarity_scores_by_alignment(self.messages[i].data, self.messages[j].data)
-                    scoreslist[i][j] = score
-                    scoreslist[j][i] = score 
-        
-        self.similarity_matrix = scoreslist
-        
-    def compute_similarity_scores_by_alignment(self, msgdata1, msgdata2):
-        if len(msgdata1) != len(msgdata2):
-            logging.error("The two compared messages don't have same length.")
-            return -2
-        # TODO: use NW to get more accurate score
-        result = [1 for i in range(len(msgdata1)) if msgdata1[i]==msgdata2[i]]
-        score = sum(result)/len(msgdata1)
-        return score
+        n, length = self.aligned.shape
+        self.similarity_matrix = SimilarityMatrix(n, self.length, filepath=self.filepath)
+        if self.mode == MessageSimilarity.MODE_NW:
+            self.compute_nw_counts(self.similarity_matrix)
+        else:
+            self.compute_match_counts(self.aligned, self.similarity_matrix)
+
+    # match count of a row with a duplicate of itself
+    def get_self_counts(self):
+        if self.mode == MessageSimilarity.MODE_NW:
+            _, lengths = self.get_sequences()
+            return lengths
+        return np.full(len(self.aligned), self.length, dtype=np.int64)
+
+    # output: padded matrix of the sequences and their lengths
+    def get_sequences(self):
+        if self.sequences is None:
+            gaps = np.array([MessageSimilarity.GAP, ord('~')], dtype=np.uint8)
+            self.sequences = NeedlemanWunsch.pad([row[~np.isin(row, gaps)] for row in self.aligned])
+        return self.sequences
+
+    # num of matched characters of the NW alignment of each pair, by blocks of rows
+    def compute_nw_counts(self, similarity_matrix):
+        n = len(self.aligned)
+        nw = NeedlemanWunsch()
+        padded, lengths = self.get_sequences()
+        block = max(MessageSimilarity.NW_BATCH_SIZE // max(n, 1), 1)
+        for i0 in range(0, n, block):
+            rows, cols = self.get_upper_pairs(n, i0, min(i0 + block, n))
+            if len(rows) > 0:
+                similarity_matrix.set_pairs(rows, cols, nw.count_matches(padded, lengths, rows, cols, MessageSimilarity.NW_BATCH_SIZE))
+
+        return similarity_matrix
+
+    # the pairs (i, j) with i in [i0, i1) and i < j < n
+    @staticmethod
+    def get_upper_pairs(n, i0, i1):
+        num_cols = n - 1 - np.arange(i0, i1)
+        rows = np.repeat(np.arange(i0, i1), num_cols)
+        starts = np.cumsum(num_cols) - num_cols
+        cols = np.arange(len(rows)) - np.repeat(starts, num_cols) + rows + 1
+        return rows, cols
+
+    # num of equal columns of each pair of aligned messages, stored into the condensed similarity_matrix
+    # for each symbol c: counts += onehot_c(A) @ onehot_c(B).T, computed by blocks of rows/columns (upper triangle)
+    @staticmethod
+    def compute_match_counts(aligned, similarity_matrix):
+        n, length = aligned.shape
+        symbols = np.unique(aligned)
+
+        # 2 one-hot blocks (b x L, float32) and the product (b x b, float32)
+        block = int((np.sqrt(4 * length * length + MessageSimilarity.BLOCK_BYTES) - 2 * length) / 2)
+        block = max(block, 1)
+        for i0 in range(0, n, block):
+            rows = aligned[i0:i0 + block]
+            for j0 in range(i0, n, block):
+                cols = aligned[j0:j0 + block]
+                # float32 products of 0/1 are exact for counts < 2^24
+                counts_block = np.zeros((len(rows), len(cols)), dtype=np.float32)
+                for c in symbols:
+                    onehot_rows = rows == c
+                    if not onehot_rows.any():
+                        continue
+                    counts_block += onehot_rows.astype(np.float32) @ (cols == c).astype(np.float32).T
+                similarity_matrix.set_block(i0, j0, counts_block)
+
+        return similarity_matrix
 
     # compute p_m
-    def compute_constraint_message_similarity(self, symbols):
+    def compute_constraint_message_similarity(self, clusters):
         logging.debug("[+] Compute observation probabilities of message similarity")
-        sn_list = [str(s.name) for s in symbols.values()]
+        sn_list = clusters.names
 
-        inner_inter_scores = self.compute_inner_inter_scores(symbols)
+        if self.num_samples is None:
+            inner_inter_scores = self.compute_inner_inter_scores(clusters)
+        else:
+            inner_inter_scores = self.sample_inner_inter_scores(clusters)
+            self.confidence_intervals = self.compute_confidence_intervals(inner_inter_scores)
         symbol_m = self.compute_similarity_constraints(inner_inter_scores)
 
         p_m = list()
@@ -72,50 +164,157 @@ class MessageSimilarity:
         return p_m
 
     # compute Inner/Inter scores
-    # inner_inter_scores: {symbol_name: [num of msgs, inner scores, inter scores]}
-    def compute_inner_inter_scores(self, symbols):
+    # inner_inter_scores: {symbol_name: [row indices, inner counts, inter counts, inner weights, inter weights]}
+    # counts: numpy arrays of the match counts of the pairs of distinct rows (score = count / length)
+    # weights: the num of message pairs of each count (None: one pair each)
+    # here all symbols are computed in one pass over the row blocks of the matrix: the pairs are grouped by
+    # (symbol, count) with np.bincount, so the counts are the distinct counts of a symbol and the weights their histogram
+    # a row of weight w also has w * (w - 1) / 2 inner pairs with its duplicates
+    def compute_inner_inter_scores(self, clusters):
         logging.debug("[+] Compute Inner/Inter Scores")
+        n = len(clusters.row_labels)
+        num_symbols, num_bins = len(clusters), self.length + 1
+        labels = np.asarray(clusters.row_labels, dtype=np.int64)
+        weights = clusters.row_weights
+        self_counts = self.get_self_counts()
+        block = max(MessageSimilarity.BLOCK_BYTES // (40 * max(n, 1)), 1)
+
+        # histograms of the counts, flattened: [inner, inter] * num_symbols * num_bins + symbol * num_bins + count
+        size = num_symbols * num_bins
+        hist = np.zeros(2 * size, dtype=np.float64)
+        for i0 in range(0, n, block):
+            rows = np.arange(i0, min(i0 + block, n))
+            counts = self.similarity_matrix.get_counts(rows, np.arange(n))
+            # inner: pairs of the same symbol (i < j), inter: the symbol of the row x the others
+            same = labels[rows][:, None] == labels[None, :]
+            weights_pairs = np.where(same & (rows[:, None] >= np.arange(n)[None, :]), 0, weights[rows][:, None] * weights[None, :])
+            bins = np.where(same, 0, size) + labels[rows][:, None] * num_bins + counts
+            hist += np.bincount(bins.ravel(), weights=weights_pairs.ravel(), minlength=len(hist))
+        inner_hist, inter_hist = hist[:size], hist[size:]
+
+        duplicated = np.flatnonzero(weights > 1)
+        inner_hist += np.bincount(labels[duplicated] * num_bins + self_counts[duplicated],
+                                  weights=weights[duplicated] * (weights[duplicated] - 1) // 2, minlength=size)
+
+        inner_inter_scores = dict()
+        for label, (sn, indices) in enumerate(zip(clusters.names, clusters.row_indices)):
+            inner_counts, inner_weights = self.split_hist(inner_hist[label * num_bins:(label + 1) * num_bins])
+            inter_counts, inter_weights = self.split_hist(inter_hist[label * num_bins:(label + 1) * num_bins])
+            inner_inter_scores[sn] = [indices, inner_counts, inter_counts, inner_weights, inter_weights]
 
-        dict_mid_i = dict()
-        for i,message in enumerate(self.messages):
-            dict_mid_i[message.id] = i
+        return inner_inter_scores
+
+    # output: the counts of the non-empty bins of a histogram and their weights
+    @staticmethod
+    def split_hist(hist):
+        counts = np.flatnonzero(hist)
+        return counts, hist[counts]
+
+    # sampled Inner/Inter scores: same output as compute_inner_inter_scores, with num_samples pairs of each kind
+    # inner pairs are drawn uniformly, inter pairs are stratified by the symbol of the other message
+    # (its share of the budget is proportional to its size), so small symbols are always represented
+    # pairs of messages are drawn, and scored by their distinct rows (clusters.rows), so the weights are None
+    def sample_inner_inter_scores(self, clusters):
+        logging.debug("[+] Sample Inner/Inter Scores")
+        rng = np.random.default_rng(self.seed)
+        budget = self.num_samples
 
         inner_inter_scores = dict()
+        for label, (sn, indices) in enumerate(zip(clusters.names, clusters.indices)):
+            num = len(indices)
+            # inner pairs
+            if num * (num - 1) // 2 <= budget:
+                i, j = np.triu_indices(num, k=1)
+            else:
+                i = rng.integers(0, num, budget)
+                j = rng.integers(0, num - 1, budget)
+                j += j >= i
+            inner_counts = self.count_pairs(clusters.rows[indices[i]], clusters.rows[indices[j]])
+
+            # inter pairs
+            others = [indices_other for label_other, indices_other in enumerate(clusters.indices) if label_other != label]
+            num_others = sum(len(indices_other) for indices_other in others)
+            if num * num_others <= budget:
+                rows = np.repeat(indices, num_others)
+                cols = np.tile(np.concatenate(others), num) if others else np.zeros(0, dtype=np.int64)
+            else:
+                cols = list()
+                for indices_other in others:
+                    num_strata = max(int(round(budget * len(indices_other) / num_others)), 1)
+                    cols.append(indices_other[rng.integers(0, len(indices_other), num_strata)])
+                cols = np.concatenate(cols)
+                rows = indices[rng.integers(0, num, len(cols))]
+            inter_counts = self.count_pairs(clusters.rows[rows], clusters.rows[cols])
+
+            inner_inter_scores[sn] = [indices, inner_counts, inter_counts, None, None]
 
-        for s in symbols.values():
-            sn = str(s.name)
-
-            #0: message num
-            #1: inner scores list
-            #2: inter scores list
-            inner_inter_scores[sn] = list()
-            # TODO: message num is not used
-            
-            mi_list = [dict_mid_i[message.id] for message in s.messages]
-            inner_inter_scores[sn].append(mi_list) #0: message num
-            
-            inner_score_list, inter_score_list = list(), list()
-            for i in range(len(mi_list)):
-                for j in range(i + 1, len(mi_list)):
-                    inner_score_list.append(self.similarity_matrix[mi_list[i]][mi_list[j]])
-            for i in mi_list:
-                for j in range(len(self.messages)):
-                    if j not in mi_list:
-                        inter_score_list.append(self.similarity_matrix[i][j])
-            
-            inner_inter_scores[sn].append(sorted(inner_score_list, reverse=True))
-            inner_inter_scores[sn].append(sorted(inter_score_list, reverse=True))
-            
         return inner_inter_scores
 
+    # match counts of the pairs (rows[k], cols[k]), computed by blocks
+    def count_pairs(self, rows, cols):
+        if self.mode == MessageSimilarity.MODE_NW:
+            padded, lengths = self.get_sequences()
+            return NeedlemanWunsch().count_matches(padded, lengths, rows, cols, MessageSimilarity.NW_BATCH_SIZE)
+        counts = np.empty(len(rows), dtype=np.uint16 if self.length <= np.iinfo(np.uint16).max else np.uint32)
+        block = max(MessageSimilarity.BLOCK_BYTES // (2 * self.length), 1)
+        for k0 in range(0, len(rows), block):
+            counts[k0:k0 + block] = np.count_nonzero(self.aligned[rows[k0:k0 + block]] == self.aligned[cols[k0:k0 + block]], axis=1)
+        return counts
+
+    # bootstrap percentile intervals of p_m (1 - eer) of each symbol
+    def compute_confidence_intervals(self, inner_inter_scores):
+        rng = np.random.default_rng(self.seed)
+        alpha = (1 - MessageSimilarity.CONFIDENCE) / 2
+
+        confidence_intervals = dict()
+        for sn, (indices, inner_counts, inter_counts, _, _) in inner_inter_scores.items():
+            if len(inner_counts) == 0 or len(inter_counts) == 0:
+                confidence_intervals[sn] = (0.0, 0.0)
+                continue
+            p_list = list()
+            for _ in range(MessageSimilarity.NUM_BOOTSTRAP):
+                inner_resampled = inner_counts[rng.integers(0, len(inner_counts), len(inner_counts))]
+                inter_resampled = inter_counts[rng.integers(0, len(inter_counts), len(inter_counts))]
+                p_list.append(1 - self.compute_eer_by_counts(inner_resampled, inter_resampled, self.length))
+            confidence_intervals[sn] = (float(np.quantile(p_list, alpha)), float(np.quantile(p_list, 1 - alpha)))
+
+        return confidence_intervals
+
     # compute similarity constraints of each cluster
     # symbol_m: {symbol_name: list of p_m}
     def compute_similarity_constraints(self, inner_inter_scores):
         symbol_m = {}
         for key,values in inner_inter_scores.items():
-            symbol_m[key] = 1 - self.compute_eer(values[1], values[2])
+            symbol_m[key] = 1 - self.compute_eer_by_counts(values[1], values[2], self.length, values[3], values[4])
         return symbol_m
 
+    # compute eer from the histograms of the match counts (scores only take the values count / length)
+    # the FNMR/FMR lists are the same as compute_fnmrs/compute_fmrs of the scores (each count repeated by its weight)
+    def compute_eer_by_counts(self, inner_counts, inter_counts, length, inner_weights=None, inter_weights=None):
+        if len(inner_counts) == 0 or len(inter_counts) == 0:
+            return 1 # 0.05
+
+        t_fnmr_list = self.compute_rates_by_counts(inner_counts, length, False, inner_weights)
+        t_fmr_list = self.compute_rates_by_counts(inter_counts, length, True, inter_weights)
+
+        return self.compute_eer_by_rates(t_fnmr_list, t_fmr_list)
+
+    # output: list of [t, fnmr] (or [t, fmr]), one for each distinct score
+    # fnmr(t): proportion of scores <= t, fmr(t): proportion of scores > t
+    @staticmethod
+    def compute_rates_by_counts(counts, length, is_fmr, weights=None):
+        # integer weights: the float sums are exact, so the rates are the same as of the repeated counts
+        hist = np.bincount(counts, weights=weights, minlength=length + 1)
+        values = np.flatnonzero(hist)
+        num = hist.sum()
+        num_le = np.cumsum(hist)[values]
+
+        rates = (num - num_le) / num if is_fmr else num_le / num
+        first, last = [0, 1] if is_fmr else [0, 0], [1, 0] if is_fmr else [1, 1]
+        t_rate_list = [first] + [[t, r] for t, r in zip((values / length).tolist(), rates.tolist())] + [last]
+
+        return t_rate_list
+
     # compute eer
     def compute_eer(self, inner_scores, inter_scores):
         #tfnmr = stat_scores(inner_score_list)
@@ -126,6 +325,10 @@ class MessageSimilarity:
         t_fnmr_list = self.compute_fnmrs(inner_scores)
         t_fmr_list = self.compute_fmrs(inter_scores)
 
+        return self.compute_eer_by_rates(t_fnmr_list, t_fmr_list)
+
+    # walk the FNMR/FMR curves to their crossing
+    def compute_eer_by_rates(self, t_fnmr_list, t_fmr_list):
         tfnmrlist = [x[0] for x in t_fnmr_list]
         fnmrlist = [x[1] for x in t_fnmr_list]
         tfmrlist = [x[0] for x in t_fmr_list]
@@ -0,0 +1,103 @@
+import numpy as np
+
+class NeedlemanWunsch:
+    """Batched, banded Needleman-Wunsch of many message pairs at once
+
+    The DP runs row by row for all pairs of a batch, in band coordinates (column j = i + k, |k| <= band).
+    Within a row, the horizontal (gap) dependency is resolved with a prefix max:
+      H[i][j] = max_{k <= j} (A[k] + (j - k) * gap), A = max(diagonal, up)
+    Each cell keeps score * BIG + matches, so among the optimal alignments the one with more matches is kept,
+    and both are read from the last cell.
+    """
+    MATCH = 1
+    MISMATCH = -1
+    GAP = -1
+    BAND = 32
+
+    NEG = -(1 << 60)
+    NEG_INT32 = -(1 << 30)
+
+    def __init__(self, match=MATCH, mismatch=MISMATCH, gap=GAP, band=BAND):
+        assert gap <= 0, "the gap score should not be positive"
+        self.match = match
+        self.mismatch = mismatch
+        self.gap = gap
+        self.band = band
+
+    # seqs: list of uint8 arrays
+    # output: padded matrix (num x max length) and the lengths
+    @staticmethod
+    def pad(seqs):
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        padded = np.zeros((len(seqs), max(int(lengths.max()), 1) if len(seqs) else 1), dtype=np.uint8)
+        for i, seq in enumerate(seqs):
+            padded[i, :len(seq)] = seq
+        return padded, lengths
+
+    # align seqs_a[p] with seqs_b[p] for each pair p (padded matrices and lengths)
+    # output: the score and the num of matches of the optimal alignment of each pair
+    def align(self, seqs_a, lengths_a, seqs_b, lengths_b):
+        num = len(lengths_a)
+        scores, matches = np.zeros(num, dtype=np.int64), np.zeros(num, dtype=np.int64)
+        if num == 0:
+            return scores, matches
+
+        big = int(max(lengths_a.max(), lengths_b.max())) + 1
+        # the band covers the length difference of all pairs
+        band = int(min(self.band + np.abs(lengths_a - lengths_b).max(), max(seqs_a.shape[1], seqs_b.shape[1])))
+        ks = np.arange(-band, band + 1)
+        width_b = seqs_b.shape[1]
+        gap, step_match, step_mismatch = self.gap * big, self.match * big + 1, self.mismatch * big
+        # int32 cells when the scores can't overflow (less memory traffic)
+        bound = (abs(self.match) + abs(self.mismatch) + abs(self.gap)) * (seqs_a.shape[1] + seqs_b.shape[1] + 2 * band + 1) * big
+        dtype, neg = (np.int32, NeedlemanWunsch.NEG_INT32) if bound < -NeedlemanWunsch.NEG_INT32 // 2 else (np.int64, NeedlemanWunsch.NEG)
+
+        # row 0: leading gaps
+        columns = ks
+        valid = (columns[None, :] >= 0) & (columns[None, :] <= lengths_b[:, None])
+        h = np.where(valid, columns[None, :] * gap, neg).astype(dtype)
+        result = np.full(num, neg, dtype=np.int64)
+        self.read_result(result, h, lengths_a, lengths_b, 0, band)
+
+        for i in range(1, int(lengths_a.max()) + 1):
+            columns = i + ks
+            valid = (columns[None, :] >= 0) & (columns[None, :] <= lengths_b[:, None])
+
+            # diagonal: (i-1, j-1) has the same offset k
+            chars_b = seqs_b[:, np.clip(columns - 1, 0, width_b - 1)]
+            equal = seqs_a[:, i - 1][:, None] == chars_b
+            diagonal = h + np.where(equal, dtype(step_match), dtype(step_mismatch))
+            diagonal[:, columns < 1] = neg
+            # up: (i-1, j) has the offset k+1
+            up = np.full_like(h, neg)
+            up[:, :-1] = h[:, 1:] + dtype(gap)
+            a = np.where(valid, np.maximum(diagonal, up), dtype(neg))
+
+            # left: prefix max along the row
+            offset = (np.arange(len(ks)) * gap).astype(dtype)[None, :]
+            h = np.maximum.accumulate(a - offset, axis=1) + offset
+            h = np.where(valid & (h > neg // 2), h, dtype(neg))
+            self.read_result(result, h, lengths_a, lengths_b, i, band)
+
+        scores, matches = result // big, result % big
+        return scores, matches
+
+    # the pairs whose sequence a ends at row i
+    @staticmethod
+    def read_result(result, h, lengths_a, lengths_b, i, band):
+        done = np.flatnonzero(lengths_a == i)
+        if len(done) > 0:
+            result[done] = h[done, lengths_b[done] - i + band]
+
+    # padded, lengths: the sequences padded once (pad)
+    # num of matched characters of each pair (padded[pairs_a[p]], padded[pairs_b[p]]), by batches of batch_size pairs
+    def count_matches(self, padded, lengths, pairs_a, pairs_b, batch_size=4096):
+        pairs_a, pairs_b = np.asarray(pairs_a), np.asarray(pairs_b)
+        # batch the pairs of similar length difference, so the band of each batch stays narrow
+        order = np.argsort(np.abs(lengths[pairs_a] - lengths[pairs_b]), kind='stable')
+        counts = np.zeros(len(pairs_a), dtype=np.int64)
+        for p0 in range(0, len(order), batch_size):
+            batch = order[p0:p0 + batch_size]
+            a, b = pairs_a[batch], pairs_b[batch]
+            _, counts[batch] = self.align(padded[a], lengths[a], padded[b], lengths[b])
+        return counts
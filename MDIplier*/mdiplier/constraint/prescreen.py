@@ -0,0 +1,113 @@
+import logging
+import os
+
+import numpy as np
+
+class CandidatePrescreen:
+    """Cheap statistical ranking of the keyword candidates before the full constraint scoring
+
+    For each candidate field (labels of the request/response messages by the field value):
+      entropy:  1 - H(field) / log2(n), low for ids/counters and 0 for constant fields
+      distinct: 1 - (num of values) / n
+      mi:       normalized mutual information between the values of a request and its response,
+                minus the bias of the plug-in estimate (so fields with many values don't look coupled)
+      session:  the proportion of responses predicted by the value of their request (majority value),
+                request values seen only once are ignored since they predict their response trivially
+    The score is the average of them, only the top_k candidates are scored by the constraints.
+    """
+    FILENAME_RANKING = "prescreen_ranking.txt"
+    COLUMNS = ['entropy', 'distinct', 'mi', 'session']
+
+    # pairs_request/pairs_response: row index (in its direction) of each request/response pair (RemoteCoupling.get_pairs)
+    def __init__(self, pairs_request, pairs_response):
+        self.pairs_request = pairs_request
+        self.pairs_response = pairs_response
+
+    # labels: {fid: [labels_request, labels_response]}, None if the field is filtered in that direction
+    # output: {fid: [score, entropy, distinct, mi, session]}
+    def compute_scores(self, labels):
+        scores = dict()
+        for fid, (labels_request, labels_response) in labels.items():
+            s_entropy, s_distinct = list(), list()
+            for labels_direction in [labels_request, labels_response]:
+                if labels_direction is None or len(labels_direction) == 0:
+                    continue
+                counts = np.bincount(labels_direction)
+                s_entropy.append(1 - self.compute_entropy(counts) / max(np.log2(len(labels_direction)), 1.0))
+                s_distinct.append(1 - len(counts) / len(labels_direction))
+            s_entropy = float(np.mean(s_entropy)) if s_entropy else 0.0
+            s_distinct = float(np.mean(s_distinct)) if s_distinct else 0.0
+
+            s_mi, s_session = 0.0, 0.0
+            if labels_request is not None and labels_response is not None and len(self.pairs_request) > 0:
+                s_mi, s_session = self.compute_pair_scores(labels_request[self.pairs_request], labels_response[self.pairs_response])
+
+            s = [s_entropy, s_distinct, s_mi, s_session]
+            scores[fid] = [float(np.mean(s))] + s
+
+        return scores
+
+    @staticmethod
+    def compute_entropy(counts):
+        p = counts[counts > 0] / counts.sum()
+        return float(-np.sum(p * np.log2(p)))
+
+    # normalized mutual information and majority consistency of the request/response values
+    def compute_pair_scores(self, values_request, values_response):
+        k_request, k_response = int(values_request.max()) + 1, int(values_response.max()) + 1
+        joint = np.bincount(values_request * k_response + values_response, minlength=k_request * k_response).reshape(k_request, k_response)
+
+        h_request = self.compute_entropy(joint.sum(axis=1))
+        h_response = self.compute_entropy(joint.sum(axis=0))
+        h_joint = self.compute_entropy(joint.ravel())
+        h_min = min(h_request, h_response)
+        mi_bias = (k_request - 1) * (k_response - 1) / (2 * len(values_request) * np.log(2))
+        s_mi = float(max(h_request + h_response - h_joint - mi_bias, 0.0) / h_min) if h_min > 0 else 0.0
+
+        joint = joint[joint.sum(axis=1) > 1]
+        s_session = float(joint.max(axis=1).sum() / joint.sum()) if joint.size > 0 else 0.0
+
+        return s_mi, s_session
+
+    # output: the fids sorted by score
+    @staticmethod
+    def rank(scores):
+        return sorted(scores, key=lambda fid: (-scores[fid][0], fid))
+
+    @staticmethod
+    def save_ranking(scores, ranking, output_dir):
+        with open(os.path.join(output_dir, CandidatePrescreen.FILENAME_RANKING), 'w') as fout:
+            fout.write("fid score {}\n".format(" ".join(CandidatePrescreen.COLUMNS)))
+            for fid in ranking:
+                fout.write("{} {}\n".format(fid, " ".join("{:.6f}".format(s) for s in scores[fid])))
+
+    # recall of the true keyword: the candidate that best explains the true labels should be in the top_k
+    # labels_true: the true keyword of each request message, labels: {fid: labels_request}
+    @staticmethod
+    def report_recall(ranking, top_k, labels_true, labels):
+        _, labels_true = np.unique(np.asarray(labels_true, dtype=str), return_inverse=True)
+        labels_true = labels_true.reshape(-1)
+
+        # the true keyword field: the best v-measure (2 * I / (H(true) + H(field))) with the true labels
+        k = int(labels_true.max()) + 1
+        h_true = CandidatePrescreen.compute_entropy(np.bincount(labels_true))
+        fid_true, v_max = None, None
+        for fid in ranking:
+            if labels.get(fid) is None:
+                continue
+            k_field = int(labels[fid].max()) + 1
+            joint = np.bincount(labels[fid] * k + labels_true, minlength=k_field * k).reshape(k_field, k)
+            h_field = CandidatePrescreen.compute_entropy(joint.sum(axis=1))
+            mi = h_true + h_field - CandidatePrescreen.compute_entropy(joint.ravel())
+            v = 2 * mi / (h_true + h_field) if h_true + h_field > 0 else 1.0
+            if v_max is None or v > v_max:
+                fid_true, v_max = fid, v
+
+        if fid_true is None:
+            logging.warning("No candidate to compute the prescreen recall")
+            return None
+        rank = ranking.index(fid_true)
+        recall = 1.0 if rank < top_k else 0.0
+        print("[++++++++] Prescreen recall: true keyword field {} ranked {}/{}, top_k {}, recall {}".format(fid_true, rank + 1, len(ranking), top_k, recall))
+
+        return recall
@@ -14,163 +14,123 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
-import copy
 import logging
 
-from netzob.Model.Vocabulary.Session import Session
+import numpy as np
+
 
 class RemoteCoupling:
     TEST_TYPE_REQUEST = 0
     TEST_TYPE_RESPONSE = 1
-
-    def __init__(self, messages_all, symbols_request, symbols_response, direction_list):
-        self.messages_all = messages_all
-        self.symbols_request = symbols_request
-        self.symbols_response = symbols_response
-        self.direction_list = direction_list
+    # how a response is paired with its request:
+    #   session: the previous request of the same flow (both endpoints)
+    #   window:  the latest request sent by the receiver of the response within WINDOW seconds
+    #            (broadcast and multi-party traffic, e.g., bacnet and lon, where flows are not sessions)
+    PAIRING_SESSION = 'session'
+    PAIRING_WINDOW = 'window'
+    PAIRINGS = [PAIRING_SESSION, PAIRING_WINDOW]
+    WINDOW = 1.0
+
+    # clusters_request/clusters_response: FieldClusters of the request/response messages
+    # session_pairs: row indices (in each direction) of the request/response pairs (get_pairs)
+    def __init__(self, clusters_request, clusters_response, session_pairs):
+        self.clusters_request = clusters_request
+        self.clusters_response = clusters_response
+        self.session_pairs = session_pairs
 
         self.pairs_request = dict()
         self.pairs_response = dict()
 
-    # Use directionlist to check if it is valid session
+    # request/response pairs of the trace by pairing (PAIRINGS)
+    # they only depend on the trace, so they are computed once for all fields
+    # output: the row indices of the pairs in the request/response matrices
+    @staticmethod
+    def get_pairs(store, direction_list, pairing=PAIRING_SESSION, window=WINDOW):
+        assert pairing in RemoteCoupling.PAIRINGS, "unknown pairing: {}".format(pairing)
+        if pairing == RemoteCoupling.PAIRING_WINDOW:
+            return RemoteCoupling.get_window_pairs(store, direction_list, window)
+        return RemoteCoupling.get_session_pairs(store, direction_list)
+
+    # pair each response with the previous request of its session, the messages before the first request are skipped
+    @staticmethod
+    def get_session_pairs(store, direction_list):
+        is_request = np.asarray(direction_list) == 0
+        order, starts = store.sessions()
+        positions_request, positions_response = RemoteCoupling.pair_last_request(is_request[order], starts)
+
+        return RemoteCoupling.get_rows(is_request, order[positions_request], order[positions_response])
+
+    # pair each response with the latest request of its receiver (the source of the request is the destination
+    # of the response, so requests to a broadcast address are paired too), only if it is at most window seconds older
+    # all messages are sorted once by (requester, date) and merged in one pass
+    @staticmethod
+    def get_window_pairs(store, direction_list, window):
+        is_request = np.asarray(direction_list) == 0
+        requester = np.where(is_request, store.source_id, store.destination_id)
+        order = np.lexsort((store.timestamp, requester))
+        requester = requester[order]
+        starts = np.flatnonzero(np.r_[True, requester[1:] != requester[:-1]]) if len(order) > 0 else np.zeros(0, dtype=np.int64)
+        positions_request, positions_response = RemoteCoupling.pair_last_request(is_request[order], starts)
+
+        messages_request, messages_response = order[positions_request], order[positions_response]
+        in_window = store.timestamp[messages_response] - store.timestamp[messages_request] <= window
+        logging.debug("Time-window pairing: {} of {} pairs within {}s".format(np.count_nonzero(in_window), len(in_window), window))
+
+        return RemoteCoupling.get_rows(is_request, messages_request[in_window], messages_response[in_window])
+
+    # is_request: of the sorted messages, starts: the position of the first message of each group
+    # output: the positions of each response and of the last request before it in its group
+    @staticmethod
+    def pair_last_request(is_request, starts):
+        positions = np.arange(len(is_request))
+        group_start = np.zeros(len(is_request), dtype=np.int64)
+        group_start[starts] = starts
+        group_start = np.maximum.accumulate(group_start)
+        last_request = np.maximum.accumulate(np.where(is_request, positions, -1))
+
+        valid = ~is_request & (last_request >= group_start)
+        return last_request[valid], positions[valid]
+
+    # output: the row (in the matrix of its direction) of each request/response message
+    @staticmethod
+    def get_rows(is_request, messages_request, messages_response):
+        rows = np.empty(len(is_request), dtype=np.int64)
+        rows[is_request] = np.arange(np.count_nonzero(is_request))
+        rows[~is_request] = np.arange(np.count_nonzero(~is_request))
+
+        return rows[messages_request], rows[messages_response]
+
+    # count the (request symbol, response symbol) of all pairs at once
     def compute_pairs_by_directionlist(self):
         logging.debug("[+] Compute request/respnse pairs info")
+        pairs_request, pairs_response = self.session_pairs
+        k_request, k_response = len(self.clusters_request), len(self.clusters_response)
 
-        symbolList_request = list(self.symbols_request.values())
-        symbolList_response = list(self.symbols_response.values())
-        symbolNameList_request = [str(s.name) for s in self.symbols_request.values()]
-        symbolNameList_response = [str(s.name) for s in self.symbols_response.values()]
-
-        # generate new messages
-        messages = copy.deepcopy(self.messages_all)
-        sessions = Session(messages)
-        # lenofSession = len(sessions.getTrueSessions())
-        # print("lenth of session: {0}".format(lenofSession))
-
-        dict_mid_sn = dict()
-        for s in self.symbols_request.values():
-            sn = str(s.name)
-            for message in s.messages:
-                dict_mid_sn[message.id] = sn
-        for s in self.symbols_response.values():
-            sn = str(s.name)
-            for message in s.messages:
-                dict_mid_sn[message.id] = sn
-
-        for i in range(len(self.direction_list)):
-            data = [dict_mid_sn[messages[i].id], self.direction_list[i]]
-            messages[i].data = data
-
-        # count pair info
-        dict_request, dict_response = dict(), dict()
-        for sn in symbolNameList_request:
-            dict_request[sn] = dict()
-        for sn in symbolNameList_response:
-            dict_response[sn] = dict()
-
-        # TODO: improve
-        for session in sessions.getTrueSessions():
-            messages_list = list(session.messages.values())
-            messages_list = sorted(messages_list, key=lambda x:x.date)
-
-            #Check if it is invalid (the first is request)
-            '''
-            if messages_list[0].data[1] != 0:
-                continue
-            '''
-            '''
-            # Check if it is invalid (only request)
-            srcIP_list = [message.source for message in messages_list]
-            if len(set(srcIP_list)) == 1:
-                #print("This session is invalid.")
-                continue
-            '''
-
-            # Find the first request msg
-            i_first_request_msg = -1
-            for i,message in enumerate(messages_list):
-                if message.data[1] == 0:
-                    i_first_request_msg = i 
-                    break
-            if i_first_request_msg == -1:
-                continue
-
-            #requestSrcIP = str(messages_list[0].source)
-            preRequestS = None  
-            for message in messages_list[i_first_request_msg:]:
-                sn = message.data[0]
-                if message.data[1] == 0:
-                    preRequestS = sn
-                else:
-                    if sn in dict_request[preRequestS]:
-                        dict_request[preRequestS][sn] += 1
-                    else:
-                        dict_request[preRequestS][sn] = 1
-                    if preRequestS in dict_response[sn]:
-                        dict_response[sn][preRequestS] += 1
-                    else:
-                        dict_response[sn][preRequestS] = 1
-        #print(dict_request)
-        
-        '''
-        print("Request pairs info:")
-        for key, dict_key in dict_request.items():
-            print(repr(key))
-            list_msgcount= sorted(dict_key.items(),key=lambda x:x[1],reverse=True)
-            print(list_msgcount)
-
-        print("Response pairs info:")
-        for key, dict_key in dict_response.items():
-            print(repr(key))
-            list_msgcount= sorted(dict_key.items(),key=lambda x:x[1],reverse=True)
-            print(list_msgcount)
-        '''
+        labels_request = self.clusters_request.labels[pairs_request].astype(np.int64)
+        labels_response = self.clusters_response.labels[pairs_response].astype(np.int64)
+        joint = np.bincount(labels_request * k_response + labels_response, minlength=k_request * k_response).reshape(k_request, k_response)
 
         # compute pairs constraints results
         # method 1: use the lenth
         # method 2: use the proportion of the larger one
-        for s in symbolNameList_request:
-            # method 1
-            # self.pairs_request[s] = 1 / len(dict_request[s])
-            # method 2
-            list_msgcount= sorted(dict_request[s].items(),key=lambda x:x[1],reverse=True)
-            # print(list_msgcount)
-            count_total = 0
-            for item in list_msgcount:
-                count_total += item[1]
-            if len(list_msgcount) > 0:
-                self.pairs_request[s] = list_msgcount[0][1] / count_total
-            else:
-                self.pairs_request[s] = 0
-        for s in symbolNameList_response:
-            # method 1
-            #self.pairs_response[s] = 1 / len(dict_response[s])
-            # method 2
-            list_msgcount= sorted(dict_response[s].items(),key=lambda x:x[1],reverse=True)
-            count_total = 0
-            for item in list_msgcount:
-                count_total += item[1]
-            if len(list_msgcount) > 0:
-                self.pairs_response[s] = list_msgcount[0][1] / count_total
-            else:
-                self.pairs_response[s] = 0
-        '''
-        print("Number of Request msg types: {0}".format(len(symbolNameList_request)))
-        print(dict_result_request)
-        print("Number of Response msg types: {0}".format(len(symbolNameList_response)))
-        print(self.pairs_response)
-        '''
-        return 
+        for joint_direction, sn_list, pairs in [(joint, self.clusters_request.names, self.pairs_request),
+                                                (joint.T, self.clusters_response.names, self.pairs_response)]:
+            count_total = joint_direction.sum(axis=1)
+            count_max = joint_direction.max(axis=1) if joint_direction.shape[1] > 0 else np.zeros(len(sn_list), dtype=np.int64)
+            for s, count, total in zip(sn_list, count_max.tolist(), count_total.tolist()):
+                pairs[s] = count / total if total > 0 else 0
+
+        return
 
     # compute p_r
     def compute_constraint_remote_coupling(self, direction):
         test_type = "request" if direction == RemoteCoupling.TEST_TYPE_REQUEST else "response"
         logging.debug("[+] Compute observation probabilities of remote coupling: {}".format(test_type))
         
-        symbols = self.symbols_request if direction == RemoteCoupling.TEST_TYPE_REQUEST else self.symbols_response
+        clusters = self.clusters_request if direction == RemoteCoupling.TEST_TYPE_REQUEST else self.clusters_response
         pairs = self.pairs_request if direction == RemoteCoupling.TEST_TYPE_REQUEST else self.pairs_response
 
-        sn_list = [str(s.name) for s in symbols.values()]
+        sn_list = clusters.names
         p_r = list()
         for s in sn_list:
             if pairs[s] > 0:
@@ -0,0 +1,76 @@
+import logging
+import os
+
+import numpy as np
+
+class SimilarityMatrix:
+    """Condensed matrix of the similarity scores of the aligned messages
+
+    counts: the num of equal columns of each pair i < j (upper triangle in row-major order, as scipy's squareform)
+    length: the length of the aligned messages (the same for all pairs), score(i, j) = counts / length
+    The score of a message with itself is SCORE_SELF. With filepath, counts are backed by np.memmap, the file is
+    unlinked as soon as it is mapped, so it is freed with the matrix (also on errors) and forked workers keep the mapping.
+    """
+    SCORE_SELF = 100.0
+
+    def __init__(self, num, length, counts=None, filepath=None):
+        self.num = num
+        self.length = length
+        self.filepath = filepath
+
+        if counts is None:
+            dtype = np.uint16 if length <= np.iinfo(np.uint16).max else np.uint32
+            size = num * (num - 1) // 2
+            if filepath is not None and size > 0:
+                logging.debug("Similarity matrix is backed by {}".format(filepath))
+                counts = np.memmap(filepath, dtype=dtype, mode='w+', shape=(size,))
+                os.remove(filepath)
+            else:
+                counts = np.zeros(size, dtype=dtype)
+        self.counts = counts
+
+    def __len__(self):
+        return self.num
+
+    # index of the pair (i, j) in counts, i < j
+    def condensed_index(self, i, j):
+        return self.num * i - i * (i + 1) // 2 + (j - i - 1)
+
+    # block_counts: the counts of rows [i0, i0+b) x columns [j0, j0+c), only the pairs i < j are stored
+    def set_block(self, i0, j0, block_counts):
+        rows = np.arange(i0, i0 + block_counts.shape[0], dtype=np.int64)[:, None]
+        cols = np.arange(j0, j0 + block_counts.shape[1], dtype=np.int64)[None, :]
+        mask = rows < cols
+        rows, cols = np.broadcast_to(rows, mask.shape)[mask], np.broadcast_to(cols, mask.shape)[mask]
+        self.counts[self.condensed_index(rows, cols)] = block_counts[mask]
+
+    # counts of the pairs (rows[k], cols[k]), rows[k] < cols[k]
+    def set_pairs(self, rows, cols, counts):
+        self.counts[self.condensed_index(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))] = counts
+
+    # output: the match counts of rows x cols (the count of a message with itself is length)
+    def get_counts(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)[:, None]
+        cols = np.asarray(cols, dtype=np.int64)[None, :]
+        low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+        same = low == high
+        index = self.condensed_index(low, np.where(same, low + 1, high))
+
+        counts = np.empty(same.shape, dtype=self.counts.dtype)
+        counts[~same] = self.counts[index[~same]]
+        counts[same] = self.length
+
+        return counts
+
+    # output: the scores of rows x cols (float64)
+    def get_block(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        scores = self.get_counts(rows, cols) / self.length
+        scores[rows[:, None] == cols[None, :]] = SimilarityMatrix.SCORE_SELF
+
+        return scores
+
+    def get_row(self, i):
+        return self.get_block([i], np.arange(self.num))[0]
+
@@ -0,0 +1,25 @@
+import numpy as np
+
+class UniqueRows:
+    """Distinct rows of the aligned messages of one direction
+
+    Repeated messages (e.g., polling) have the same aligned row, so the constraints are computed once per
+    distinct row and weighted by its multiplicity.
+    rows:    u x L matrix of the distinct rows, in the order of their first message
+    weights: the num of messages of each row
+    inverse: the row of each message
+    """
+
+    def __init__(self, aligned):
+        rows, index_first, inverse, weights = np.unique(aligned, axis=0, return_index=True, return_inverse=True, return_counts=True)
+
+        # keep the order of the messages, so labels numbered by first appearance are the same for rows and messages
+        order = np.argsort(index_first)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        self.rows = np.ascontiguousarray(rows[order])
+        self.weights = weights[order].astype(np.int64)
+        self.inverse = rank[inverse.reshape(-1)]
+
+    def __len__(self):
+        return len(self.rows)
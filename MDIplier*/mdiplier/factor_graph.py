@@ -1,8 +1,13 @@
-from pgmpy.models import FactorGraph
-from pgmpy.factors.discrete import DiscreteFactor
-from pgmpy.inference import BeliefPropagation
+import numpy as np
 
 class MyFactorGraph:
+    """Factor graph of the keyword k and its observations (m/r/s/d/v of each cluster)
+
+    The graph is a star centred on k: each observation x has a unary factor phi1(x) and the pairwise
+    factors phi2(k, x) (k -> x) and/or phi3(k, x) (x -> k). It is a tree, so the posterior of k is exactly
+    the normalized product of the messages m_x(k) = sum_x phi1(x) * phi2(k, x) * phi3(k, x),
+    computed in log space. compute_pk_bp runs belief propagation with pgmpy (optional) on the same graph.
+    """
 
     def __init__(self, p_observation, p_implication):
         self.p_observation = p_observation
@@ -13,14 +18,62 @@ class MyFactorGraph:
     def compute_pk(self, type_list, fid):
         assert len(type_list) == 5, print("ComputePk Error: number of type_list should be 5")
 
+        # log of the product of the messages to k: [k=0, k=1]
+        log_k = np.zeros(2)
+        for i in range(len(type_list)):
+            if type_list[i] not in [0, 1, 2] or len(self.p_observation[fid][i]) == 0:
+                continue
+            p_ktox = self.p_implication[fid][0][i] if type_list[i] in [0, 1] else None
+            p_xtok = self.p_implication[fid][1][i] if type_list[i] in [0, 2] else None
+            log_k += np.sum(self.compute_log_messages(self.p_observation[fid][i], p_ktox, p_xtok), axis=0)
+
+        return float(np.exp(log_k[1] - np.logaddexp(log_k[0], log_k[1])))
+
+    # Compute Pk of many graphs at once (all observations are k2x & x2k)
+    # p_x/p_ktox/p_xtok: the observations of all graphs concatenated, groups: the graph of each observation
+    # output: pk of each graph
+    @staticmethod
+    def compute_pk_batch(p_x, p_ktox, p_xtok, groups, num_groups):
+        log_messages = MyFactorGraph.compute_log_messages(p_x, p_ktox, p_xtok)
+        log_k0 = np.bincount(groups, weights=log_messages[:, 0], minlength=num_groups)
+        log_k1 = np.bincount(groups, weights=log_messages[:, 1], minlength=num_groups)
+
+        return np.exp(log_k1 - np.logaddexp(log_k0, log_k1))
+
+    # log of the message of each observation to k (n x 2), p_ktox/p_xtok: None if the factor is not used
+    @staticmethod
+    def compute_log_messages(p_x, p_ktox, p_xtok):
+        phi1 = MyFactorGraph.get_factor_x(p_x)
+        phi2 = MyFactorGraph.get_factor_k2x(p_ktox) if p_ktox is not None else 1.0
+        phi3 = MyFactorGraph.get_factor_x2k(p_xtok) if p_xtok is not None else 1.0
+        with np.errstate(divide='ignore'):
+            return np.log(np.sum(phi1[:, None, :] * phi2 * phi3, axis=2))
+
+    # the factors of each observation, with the values of the DiscreteFactors of compute_pk_bp
+    # phi1: n x 2 [x], phi2/phi3: n x 2 x 2 [k][x]
+    @staticmethod
+    def get_factor_x(p_x):
+        p = np.asarray(p_x, dtype=np.float64)
+        return np.stack([1 - p, p], axis=-1)
+
+    @staticmethod
+    def get_factor_k2x(p_ktox):
+        p = np.asarray(p_ktox, dtype=np.float64)
+        return np.stack([p, p, 1 - p, p], axis=-1).reshape(-1, 2, 2)
+
+    @staticmethod
+    def get_factor_x2k(p_xtok):
+        p = np.asarray(p_xtok, dtype=np.float64)
+        return np.stack([p, 1 - p, p, p], axis=-1).reshape(-1, 2, 2)
+
+    # Compute Pk by belief propagation (requires pgmpy)
+    def compute_pk_bp(self, type_list, fid):
+        from pgmpy.models import FactorGraph
+        from pgmpy.inference import BeliefPropagation
+
+        assert len(type_list) == 5, print("ComputePk Error: number of type_list should be 5")
+
         constraint_name = ['m', 'r', 's', 'd', 'v']
-        '''
-        m, r, s, d, v = type_list
-        p_m, p_r, p_s, p_d, p_v = self.p_observation
-        p_ktox, p_xtok = self.p_implication
-        p_ktom, p_ktor, p_ktos, p_ktod, p_ktov = p_ktox
-        p_mtok, p_rtok, p_stok, p_dtok, p_vtok = p_xtok
-        '''
         fg = FactorGraph()
         fg.add_node('k')
 
@@ -31,42 +84,6 @@ class MyFactorGraph:
                 fg = self.add_constraints_k2x(fg, self.p_observation[fid][i], self.p_implication[fid][0][i], constraint_name[i])
             elif type_list[i] == 2:
                 fg = self.add_constraints_x2k(fg, self.p_observation[fid][i], self.p_implication[fid][1][i], constraint_name[i])
-        '''
-        if m == 0:
-            fg = add_constraints_kv_vk(fg, p_m, p_ktom, p_mtok, 'm')
-        elif m == 1:
-            fg = add_constraints_kv(fg, p_m, p_mtok, 'm')
-        elif m == 2:
-            fg = add_constraints_vk(fg, p_m, p_mtok, 'm')
-
-        if r == 0:
-            fg = add_constraints_kv_vk(fg, p_r, p_ktor, p_rtok, 'r')
-        elif r == 1:
-            fg = add_constraints_kv(fg, p_r, p_ktor, 'r')
-        elif r == 2:
-            fg = add_constraints_vk(fg, p_r, p_rtok, 'r')
-
-        if s == 0:
-            fg = add_constraints_kv_vk(fg, p_s, p_ktos, p_stok, 's')
-        elif s == 1:
-            fg = add_constraints_kv(fg, p_s, p_ktos, 's')
-        elif s == 2:
-            fg = add_constraints_vk(fg, p_s, p_stok, 's')
-
-        if d == 0:
-            fg = add_constraints_kv_vk(fg, p_d, p_ktod, p_dtok, 'd')
-        elif d == 1:
-            fg = add_constraints_kv(fg, p_d, p_ktod, 'd')
-        elif d == 2:
-            fg = add_constraints_vk(fg, p_d, p_dtok, 'd')
-
-        if v == 0:
-            fg = add_constraints_kv_vk(fg, p_v, p_ktov, p_vtok, 'v')
-        elif v == 1:
-            fg = add_constraints_kv(fg, p_v, p_ktov, 'v')
-        elif v == 2:
-            fg = add_constraints_vk(fg, p_v, p_vtok, 'v')
-        '''
 
         bp = BeliefPropagation(fg)
 
@@ -81,6 +98,8 @@ class MyFactorGraph:
     # Addd Constraints
     # k -> x
     def add_constraints_k2x(self, fg, p_x, p_ktox, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
+
         for i in range(len(p_x)):
             p1 = p_x[i]
             p2 = p_ktox[i]
@@ -94,6 +113,8 @@ class MyFactorGraph:
 
     # x -> k
     def add_constraints_x2k(self, fg, p_x, p_xtok, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
+
         for i in range(len(p_x)):
             p1 = p_x[i]
             p3 = p_xtok[i]
@@ -107,6 +128,8 @@ class MyFactorGraph:
 
     # k -> x & x -> k
     def add_constraints_k2x_x2k(self, fg, p_x, p_ktox, p_xtok, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
+
         for i in range(len(p_x)):
             p1 = p_x[i]
             p2 = p_ktox[i]
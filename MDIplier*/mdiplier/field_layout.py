@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+class FieldLayout:
+    """Offsets of the fields in the aligned messages
+
+    starts/ends: prefix sums of the field sizes (in aligned characters), so the slice of a field is O(1)
+    type_codes:  0: static (S), 1: dynamic (D), 2: variable (V)
+    """
+    TYPE_STATIC = 0
+    TYPE_DYNAMIC = 1
+    TYPE_VARIABLE = 2
+    TYPE_CODES = {'S': TYPE_STATIC, 'D': TYPE_DYNAMIC, 'V': TYPE_VARIABLE}
+
+    def __init__(self, sizes, type_codes):
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.type_codes = np.asarray(type_codes, dtype=np.int8)
+        self.ends = np.cumsum(self.sizes)
+        self.starts = self.ends - self.sizes
+
+    # msa_fields_info.txt: "Raw <min size in bits> <max size in bits> <S/D/V>" for each field
+    @classmethod
+    def from_fieldsinfo(cls, filepath_fields_info):
+        assert os.path.isfile(filepath_fields_info), "The fields info file doesn't exist"
+
+        sizes, type_codes = list(), list()
+        with open(filepath_fields_info) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                typename, typesizemin, typesizemax, fieldtype = line.split()
+                assert typename == "Raw", "Field type is not Raw"
+                sizes.append(int(typesizemax) // 8)
+                type_codes.append(FieldLayout.TYPE_CODES[fieldtype])
+
+        return cls(sizes, type_codes)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def slice(self, fid):
+        return int(self.starts[fid]), int(self.ends[fid])
+
+    def size(self, fid):
+        return int(self.sizes[fid])
+
+    # keyword candidates: the dynamic fields
+    def get_candidates(self):
+        return np.flatnonzero(self.type_codes == FieldLayout.TYPE_DYNAMIC).tolist()
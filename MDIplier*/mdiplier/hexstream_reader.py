@@ -0,0 +1,120 @@
+import csv
+import json
+import logging
+
+class HexstreamReader:
+    """Incremental reader of exported datasets
+
+    .json: array of {"Hexstream": ...} objects (file/*.json)
+    .csv/.out: csv with a Hexstream column (header_res/*.out, body_res/*.out, ...)
+    Optional columns: Timestamp, Direction (0/1 or request/response), Source, Destination
+    """
+    EXTENSIONS_JSON = ('.json',)
+    EXTENSIONS_CSV = ('.csv', '.out')
+
+    CHUNK_SIZE = 1 << 16
+    JSON_SKIP_CHARS = ' \t\r\n,'
+
+    KEY_HEXSTREAM = "hexstream"
+    KEY_TIMESTAMP = "timestamp"
+    KEY_DIRECTION = "direction"
+    KEY_SOURCE = "source"
+    KEY_DESTINATION = "destination"
+
+    DIRECTION_VALUES = {"0": 0, "1": 1, "request": 0, "response": 1, "req": 0, "resp": 1}
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    @staticmethod
+    def is_supported(filepath):
+        return filepath.lower().endswith(HexstreamReader.EXTENSIONS_JSON + HexstreamReader.EXTENSIONS_CSV)
+
+    # yield one normalized record per message: {hexstream, timestamp, direction, source, destination}
+    def iter_records(self):
+        if self.filepath.lower().endswith(HexstreamReader.EXTENSIONS_JSON):
+            rows = self.iter_json_array()
+        else:
+            rows = self.iter_csv_rows()
+
+        for i, row in enumerate(rows):
+            record = self.normalize_row(row)
+            if record is None:
+                logging.warning("Skip row {} without a valid Hexstream in {}".format(i, self.filepath))
+                continue
+            yield record
+
+    def iter_csv_rows(self):
+        with open(self.filepath, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+    # parse the top-level array item by item, without loading the whole document
+    def iter_json_array(self):
+        decoder = json.JSONDecoder()
+        with open(self.filepath, encoding='utf-8') as f:
+            buf, pos = '', 0
+            started = False
+            while True:
+                # skip whitespace/separators, read more data when the buffer is consumed
+                while pos < len(buf) and buf[pos] in HexstreamReader.JSON_SKIP_CHARS:
+                    pos += 1
+                if pos >= len(buf):
+                    chunk = f.read(HexstreamReader.CHUNK_SIZE)
+                    if not chunk:
+                        raise ValueError("Invalid JSON format: unterminated message array")
+                    buf, pos = chunk, 0
+                    continue
+
+                if not started:
+                    if buf[pos] != '[':
+                        raise ValueError("JSON file should contain a message array")
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == ']':
+                    return
+
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # the item is not complete yet
+                    chunk = f.read(HexstreamReader.CHUNK_SIZE)
+                    if not chunk:
+                        raise ValueError("Invalid JSON format")
+                    buf, pos = buf[pos:] + chunk, 0
+                    continue
+                yield item
+                pos = end
+
+    def normalize_row(self, row):
+        if not isinstance(row, dict):
+            return None
+        row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+        hexstream = row.get(HexstreamReader.KEY_HEXSTREAM)
+        if not isinstance(hexstream, str):
+            return None
+        try:
+            data = bytes.fromhex(hexstream.strip())
+        except ValueError:
+            return None
+
+        record = {'data': data, 'timestamp': None, 'direction': None, 'source': None, 'destination': None}
+
+        timestamp = row.get(HexstreamReader.KEY_TIMESTAMP)
+        if timestamp not in (None, ""):
+            record['timestamp'] = float(timestamp)
+
+        direction = row.get(HexstreamReader.KEY_DIRECTION)
+        if direction not in (None, ""):
+            direction = str(direction).strip().lower()
+            if direction not in HexstreamReader.DIRECTION_VALUES:
+                raise ValueError("Unknown direction value: {}".format(direction))
+            record['direction'] = HexstreamReader.DIRECTION_VALUES[direction]
+
+        for key in [HexstreamReader.KEY_SOURCE, HexstreamReader.KEY_DESTINATION]:
+            if row.get(key) not in (None, ""):
+                record[key] = str(row[key])
+
+        return record
@@ -13,12 +13,15 @@ from mdiplier import MDIplier
 from processing import Processing
 from alignment import Alignment
 from clustering import Clustering
+from constraint.constraint import Constraint
+from constraint.message_similarity import MessageSimilarity
+from constraint.remote_coupling import RemoteCoupling
 
 if __name__ == '__main__':
     
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('-i', '--input', required=True, dest='filepath_input', help='filepath of input trace')
+    parser.add_argument('-i', '--input', required=True, dest='filepath_input', help='filepath of input trace (pcap, or Hexstream json/csv)')
     parser.add_argument('-t', '--type', dest='protocol_type', help='type of the protocol (for generating the ground truth): \
         # dhcp, dnp3, icmp, modbus, ntp, smb, smb2, tftp, zeroaccess')
     parser.add_argument('-o', '--output_dir', dest='output_dir', default='tmp/', help='temp_output directory')
@@ -29,12 +32,24 @@ if __name__ == '__main__':
                         default=None, help='field_analysis_result')
     parser.add_argument('-br', '--body_field_analysis_result', dest='body_field_analysis_result',
                         default=None, help='field_analysis_result')
+    parser.add_argument('-fp', '--full_pairs', dest='full_pairs', default=False, action='store_true', help='compute observation probabilities of all request x response fid pairs')
+    parser.add_argument('-w', '--workers', dest='workers', default=1, type=int, help='number of worker processes for evaluating keyword candidates')
+    parser.add_argument('-r', '--restart', dest='restart', default=False, action='store_true', help='ignore the checkpointed observation probabilities and compute all fid pairs again')
+    parser.add_argument('-k', '--top_k', dest='top_k', default=None, type=int, help='only score the top k keyword candidates of the statistical prescreen')
+    parser.add_argument('-cf', '--composite_fields', dest='max_fields', default=1, type=int, help='search composite keywords of up to this number of fields')
+    parser.add_argument('-bw', '--beam_width', dest='beam_width', default=3, type=int, help='beam width of the composite keyword search')
+    parser.add_argument('-ss', '--similarity_samples', dest='similarity_samples', default=None, type=int, help='estimate the message similarity from this number of sampled pairs per symbol (for huge traces)')
+    parser.add_argument('-sv', '--validate_sampling', dest='validate_sampling', default=False, action='store_true', help='compare the sampled message similarity with the exact one')
+    parser.add_argument('-sm', '--similarity_mode', dest='similarity_mode', default=MessageSimilarity.MODE_COLUMN, choices=MessageSimilarity.MODES, help='score of message pairs: equal columns of the MSA or pairwise Needleman-Wunsch matches')
+    parser.add_argument('-pm', '--pairing', dest='pairing', default=RemoteCoupling.PAIRING_SESSION, choices=RemoteCoupling.PAIRINGS, help='pair responses with requests by session (flow) or by time window (e.g., for broadcast traffic)')
+    parser.add_argument('-pw', '--pairing_window', dest='pairing_window', default=RemoteCoupling.WINDOW, type=float, help='time window (seconds) of the window pairing')
+    parser.add_argument('-c', '--cache_dir', dest='cache_dir', default=None, help='directory of the preprocessed trace cache')
 
 
     args = parser.parse_args()
 
     start_time = time.time()
-    p = Processing(filepath=args.filepath_input, protocol_type=args.protocol_type, layer=args.layer)
+    p = Processing(filepath=args.filepath_input, protocol_type=args.protocol_type, layer=args.layer, cache_dir=args.cache_dir)
     # p.print_dataset_info()
     
     res_dict = {}
@@ -48,7 +63,11 @@ if __name__ == '__main__':
     mode = args.mafft_mode
     if args.protocol_type in['dnp3']:
         mode = 'linsi'
-    mdiplier = MDIplier(messages=p.messages, direction_list=p.direction_list, output_dir=args.output_dir, mode=mode, multithread=args.multithread)
+    mdiplier = MDIplier(messages=p.messages, direction_list=p.direction_list, output_dir=args.output_dir, mode=mode, multithread=args.multithread, store=p.store,
+                        pair_mode=Constraint.PAIRS_FULL if args.full_pairs else Constraint.PAIRS_DIAGONAL, workers=args.workers, resume=not args.restart, top_k=args.top_k,
+                        max_fields=args.max_fields, beam_width=args.beam_width,
+                        similarity_samples=args.similarity_samples, validate_sampling=args.validate_sampling, similarity_mode=args.similarity_mode,
+                        pairing=args.pairing, pairing_window=args.pairing_window)
     fid_inferred = mdiplier.execute()
     
     # Clustering
@@ -56,7 +75,9 @@ if __name__ == '__main__':
     messages_request, messages_response = Processing.divide_msgs_by_directionlist(mdiplier.messages, mdiplier.direction_list)
     messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(messages_aligned, mdiplier.direction_list)
 
-    clustering = Clustering(fields=mdiplier.fields, protocol_type=args.protocol_type)
+    clustering = Clustering(layout=mdiplier.layout, protocol_type=args.protocol_type)
+    if args.top_k is not None and args.protocol_type:
+        mdiplier.constraint.report_prescreen_recall(clustering.cluster_by_kw_true(messages_request))
     # clustering_result_request_true = clustering.cluster_by_kw_true(messages_request)
     # clustering_result_response_true = clustering.cluster_by_kw_true(messages_response)
     clustering_result_request_mdiplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_request_aligned)
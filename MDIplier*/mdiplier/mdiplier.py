@@ -1,20 +1,35 @@
 import logging
 import os
-
-from netzob.Model.Vocabulary.Field import Field
-from netzob.Model.Vocabulary.Types.Raw import Raw
-#from netzob.all import *
-#from netzob.Model.Vocabulary.Session import Session
-#from netzob.Model.Vocabulary.Field import Field
+import resource
+import time
 
 from alignment import Alignment
+from field_layout import FieldLayout
 from constraint.constraint import Constraint
+from constraint.checkpoint import CheckpointStore
+from constraint.message_similarity import MessageSimilarity
+from constraint.remote_coupling import RemoteCoupling
 from probabilistic_inference import ProbabilisticInference
+from composite_search import CompositeKeywordSearch
 
 class MDIplier:
-    def __init__(self, messages, direction_list=None, output_dir='tmp/', mode='ginsi', multithread=False):
+    def __init__(self, messages, direction_list=None, output_dir='tmp/', mode='ginsi', multithread=False, store=None, pair_mode=Constraint.PAIRS_DIAGONAL, workers=1, resume=True, top_k=None, max_fields=1, beam_width=3, similarity_samples=None, validate_sampling=False, similarity_mode=MessageSimilarity.MODE_COLUMN,
+                 pairing=RemoteCoupling.PAIRING_SESSION, pairing_window=RemoteCoupling.WINDOW):
         self.messages = messages
         self.direction_list = direction_list
+        self.store = store
+        self.pair_mode = pair_mode
+        self.workers = workers
+        self.resume = resume
+        self.top_k = top_k
+        # composite keywords of up to max_fields fields (1: only single fields)
+        self.max_fields = max_fields
+        self.beam_width = beam_width
+        self.similarity_samples = similarity_samples
+        self.validate_sampling = validate_sampling
+        self.similarity_mode = similarity_mode
+        self.pairing = pairing
+        self.pairing_window = pairing_window
         self.output_dir = output_dir
         self.mode = mode
         self.multithread = multithread
@@ -27,20 +42,39 @@ class MDIplier:
         
         # Alignment
         # TODO: choose mode automatically
+        stage_start = time.time()
         msa = Alignment(messages=self.messages, output_dir=self.output_dir, mode=self.mode, multithread=self.multithread)
         #msa = Alignment(messages=self.messages, output_dir=self.output_dir, multithread=True)
         msa.execute()
         # exit()
+        stage_start = self.log_stage_usage("alignment", stage_start)
         
         # Generate fields
         filepath_fields_info = os.path.join(self.output_dir, Alignment.FILENAME_FIELDS_INFO)
-        self.fields, fid_list = self.generate_fields_by_fieldsinfo(filepath_fields_info)
+        self.layout, fid_list = self.generate_fields_by_fieldsinfo(filepath_fields_info)
         logging.debug("Number of keyword candidates: {}\nfid: {}".format(len(fid_list), fid_list))
         
         # Compute probabilities of observation constraints
-        constraint = Constraint(messages=self.messages, direction_list=self.direction_list, fields=self.fields, fid_list=fid_list, output_dir=self.output_dir)
+        # the fid pairs are checkpointed as they are computed, a rerun on the same alignment only computes the missing ones
+        checkpoint = CheckpointStore.open_in(self.output_dir, self.direction_list, self.get_checkpoint_options())
+        if not self.resume:
+            checkpoint.clear()
+        constraint = Constraint(messages=self.messages, direction_list=self.direction_list, layout=self.layout, fid_list=fid_list, output_dir=self.output_dir, store=self.store, pair_mode=self.pair_mode, workers=self.workers, checkpoint=checkpoint, top_k=self.top_k,
+                                similarity_samples=self.similarity_samples, validate_sampling=self.validate_sampling, similarity_mode=self.similarity_mode,
+                                pairing=self.pairing, pairing_window=self.pairing_window)
+        self.constraint = constraint
         
-        pairs_p, pairs_size = constraint.compute_observation_probabilities()
+        ffid_list = ["{0}-{0}".format(fid) for fid in fid_list] #only test same fid for both sides
+        try:
+            pairs_p, pairs_size = constraint.compute_observation_probabilities()
+            stage_start = self.log_stage_usage("observation constraints", stage_start)
+
+            if self.max_fields > 1:
+                search = CompositeKeywordSearch(constraint, beam_width=self.beam_width, max_fields=self.max_fields)
+                pairs_p, pairs_size, ffid_list = search.execute(pairs_p, pairs_size, fid_list)
+                stage_start = self.log_stage_usage("composite keyword search", stage_start)
+        finally:
+            checkpoint.close()
         pairs_p_request, pairs_p_response = pairs_p
         pairs_size_request, pairs_size_response = pairs_size
         constraint.save_observation_probabilities(pairs_p_request, pairs_size_request, Constraint.TEST_TYPE_REQUEST)
@@ -52,49 +86,44 @@ class MDIplier:
         # Probabilistic inference
         pairs_p_all, pairs_size_all = self.merge_constraint_results(pairs_p_request, pairs_p_response, pairs_size_request, pairs_size_response)
 
-        ffid_list = ["{0}-{0}".format(fid) for fid in fid_list] #only test same fid for both sides
-        pi = ProbabilisticInference(pairs_p=pairs_p_request, pairs_size=pairs_size_request)
+        # the keyword is inferred from the requests (from the responses if the trace has no request)
+        direction = constraint.get_inference_direction()
+        pi = ProbabilisticInference(pairs_p=pairs_p[direction], pairs_size=pairs_size[direction])
         fid_inferred = pi.execute(ffid_list)
+        self.log_stage_usage("probabilistic inference", stage_start)
         
         ## TODO: iterative
         ## TODO: format inference
         
         return fid_inferred
 
-    # Generate fields from mafft results
+    # log the time and the peak RSS (KB on Linux) after each stage
+    def log_stage_usage(self, stage, stage_start):
+        now = time.time()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        logging.info("[stage] {}: {:.2f}s, peak RSS {} KB".format(stage, now - stage_start, peak_rss))
+        return now
+
+    # the non-default settings that change the observation probabilities, part of the checkpoint key
+    def get_checkpoint_options(self):
+        options = list()
+        if self.similarity_mode != MessageSimilarity.MODE_COLUMN:
+            options.append(self.similarity_mode)
+        if self.similarity_samples is not None:
+            options.append("samples:{}".format(self.similarity_samples))
+        if self.pairing != RemoteCoupling.PAIRING_SESSION:
+            options.append("{}:{}".format(self.pairing, self.pairing_window))
+
+        return options
+
+    # Generate the field layout from mafft results
     def generate_fields_by_fieldsinfo(self, filepath_fields_info):
         print("[++++++++] Generate fields")
-        assert os.path.isfile(filepath_fields_info), "The fields info file doesn't exist"
-
-        fid_list = list()
-        fields_result = list()
-        
-        with open(filepath_fields_info) as f:
-            line_list = f.readlines()
-            for i, line in enumerate(line_list):
-                typename, typesizemin, typesizemax, fieldtype = line.split()
-                typeinfo = [typename, int(typesizemin), int(typesizemax)]
-                fields_result.append(typeinfo)
-
-                if fieldtype == 'D':
-                    fid_list.append(i)
-
-        fields = self.generate_fields(fields_result)
-        logging.debug("Number of fields: {0}".format(len(fields)))
-
-        return fields, fid_list
-
-    ## Generate fields
-    def generate_fields(self, fields_result):
-        fields = list()
-        for typeinfo in fields_result:
-            if typeinfo[0] == "Raw":
-                field = Field(Raw(nbBytes=(typeinfo[1]//8, typeinfo[2]//8)))
-                fields.append(field)
-            else:
-                logging.error("Field type is not Raw")
+        layout = FieldLayout.from_fieldsinfo(filepath_fields_info)
+        fid_list = layout.get_candidates()
+        logging.debug("Number of fields: {0}".format(len(layout)))
 
-        return fields
+        return layout, fid_list
 
     def merge_constraint_results(self, pairs_p_request, pairs_p_response, pairs_size_request, pairs_size_response):
         pairs_p_all, pairs_size_all = dict(), dict()
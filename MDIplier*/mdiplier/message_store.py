@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+class MessageStore:
+    """Columnar view of a trace shared by all pipeline stages
+
+    payload:   all message bytes concatenated into one uint8 buffer
+    offsets:   message i is payload[offsets[i]:offsets[i+1]]
+    direction: 0: request, 1: response, -1: unknown
+    timestamp: capture time of each message
+    flow_id:   index of the (unordered) endpoint pair of each message
+    """
+    DIRECTION_REQUEST = 0
+    DIRECTION_RESPONSE = 1
+
+    COLUMNS = ['payload', 'offsets', 'direction', 'timestamp', 'flow_id', 'source_id', 'destination_id']
+    FILENAME_ENDPOINTS = "endpoints.json"
+
+    def __init__(self, payload, offsets, direction=None, timestamp=None, flow_id=None,
+                 source_id=None, destination_id=None, endpoints=None):
+        self.payload = payload
+        self.offsets = offsets
+        num = len(offsets) - 1
+
+        self.direction = direction if direction is not None else np.full(num, -1, dtype=np.int8)
+        self.timestamp = timestamp if timestamp is not None else np.zeros(num, dtype=np.float64)
+        self.flow_id = flow_id if flow_id is not None else np.zeros(num, dtype=np.int32)
+        self.source_id = source_id if source_id is not None else np.zeros(num, dtype=np.int32)
+        self.destination_id = destination_id if destination_id is not None else np.zeros(num, dtype=np.int32)
+        self.endpoints = endpoints if endpoints is not None else [""]
+
+        # aligned messages (n x L matrix of ascii chars), loaded after MSA
+        self.aligned = None
+
+    @classmethod
+    def from_messages(cls, messages, direction_list=None):
+        messages = list(messages)
+        num = len(messages)
+
+        datas = [bytes(message.data) for message in messages]
+        offsets = np.zeros(num + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in datas], out=offsets[1:])
+        payload = np.frombuffer(b''.join(datas), dtype=np.uint8)
+
+        if direction_list is not None:
+            assert len(direction_list) == num, "the direction_list doesn't match the messages"
+            direction = np.asarray(direction_list, dtype=np.int8)
+        else:
+            direction = None
+
+        timestamp = np.array([cls._get_attr(message, 'date', 0.0) or 0.0 for message in messages], dtype=np.float64)
+
+        dict_ep_i = dict()
+        source_id = np.empty(num, dtype=np.int32)
+        destination_id = np.empty(num, dtype=np.int32)
+        for i, message in enumerate(messages):
+            source_id[i] = dict_ep_i.setdefault(str(cls._get_attr(message, 'source', "")), len(dict_ep_i))
+            destination_id[i] = dict_ep_i.setdefault(str(cls._get_attr(message, 'destination', "")), len(dict_ep_i))
+        endpoints = sorted(dict_ep_i, key=dict_ep_i.get)
+
+        flow_id = cls.compute_flow_id(source_id, destination_id)
+
+        return cls(payload, offsets, direction=direction, timestamp=timestamp, flow_id=flow_id,
+                   source_id=source_id, destination_id=destination_id, endpoints=endpoints)
+
+    @staticmethod
+    def _get_attr(message, name, default):
+        try:
+            value = getattr(message, name)
+        except Exception:
+            return default
+        return default if value is None else value
+
+    # messages between the same two endpoints (in both directions) belong to the same flow
+    @staticmethod
+    def compute_flow_id(source_id, destination_id):
+        if len(source_id) == 0:
+            return np.zeros(0, dtype=np.int32)
+        ep_low = np.minimum(source_id, destination_id).astype(np.int64)
+        ep_high = np.maximum(source_id, destination_id).astype(np.int64)
+        keys = ep_low * (int(ep_high.max()) + 1) + ep_high
+        _, flow_id = np.unique(keys, return_inverse=True)
+        return flow_id.reshape(-1).astype(np.int32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def num_flows(self):
+        return int(self.flow_id.max()) + 1 if len(self) else 0
+
+    # zero-copy slice of the payload of message i
+    def data(self, i):
+        return memoryview(self.payload)[self.offsets[i]:self.offsets[i + 1]]
+
+    def indices(self, direction=None):
+        if direction is None:
+            return np.arange(len(self))
+        return np.flatnonzero(self.direction == direction)
+
+    def divide_by_direction(self):
+        return self.indices(MessageStore.DIRECTION_REQUEST), self.indices(MessageStore.DIRECTION_RESPONSE)
+
+    ## sessions
+    # sessions: the messages of the same flow, sorted by date
+    # output: the message indices in session order, and the position of the first message of each session
+    def sessions(self):
+        order = np.lexsort((self.timestamp, self.flow_id))
+        flow = self.flow_id[order]
+        starts = np.flatnonzero(np.r_[True, flow[1:] != flow[:-1]]) if len(order) > 0 else np.zeros(0, dtype=np.int64)
+        return order, starts
+
+    ## aligned messages
+    def load_aligned(self, filepath_output_oneline):
+        with open(filepath_output_oneline, 'rb') as f:
+            lines = f.read().split()
+        assert len(lines) == len(self), \
+            "The aligned file has {} messages, expected {}".format(len(lines), len(self))
+
+        length = max(len(line) for line in lines) if lines else 0
+        if any(len(line) != length for line in lines):
+            logging.warning("Aligned messages don't have the same length, pad them with gaps")
+            lines = [line.ljust(length, b'-') for line in lines]
+        self.aligned = np.frombuffer(b''.join(lines), dtype=np.uint8).reshape(len(lines), length)
+
+        return self.aligned
+
+    def aligned_data(self, i):
+        return self.aligned[i].tobytes().decode('ascii')
+
+    ## on-disk format: one .npy file per column (memory-mappable) and the endpoint names in json
+    def save(self, dirpath):
+        # write into a temp folder first, so an interrupted run never leaves a partial cache
+        dirpath_tmp = dirpath.rstrip(os.sep) + ".tmp"
+        if os.path.exists(dirpath_tmp):
+            shutil.rmtree(dirpath_tmp)
+        os.makedirs(dirpath_tmp)
+
+        for column in MessageStore.COLUMNS:
+            np.save(os.path.join(dirpath_tmp, column + ".npy"), np.ascontiguousarray(getattr(self, column)))
+        with open(os.path.join(dirpath_tmp, MessageStore.FILENAME_ENDPOINTS), 'w') as f:
+            json.dump(self.endpoints, f)
+
+        if os.path.exists(dirpath):
+            shutil.rmtree(dirpath)
+        os.replace(dirpath_tmp, dirpath)
+
+    @classmethod
+    def load(cls, dirpath, mmap_mode='r'):
+        columns = dict()
+        for column in MessageStore.COLUMNS:
+            columns[column] = np.load(os.path.join(dirpath, column + ".npy"), mmap_mode=mmap_mode)
+        with open(os.path.join(dirpath, MessageStore.FILENAME_ENDPOINTS)) as f:
+            columns['endpoints'] = json.load(f)
+
+        return cls(**columns)
+
+    @staticmethod
+    def exists(dirpath):
+        return all(os.path.isfile(os.path.join(dirpath, column + ".npy")) for column in MessageStore.COLUMNS)
+
+    # rebuild netzob messages for the stages that still work on message objects
+    def to_messages(self):
+        from netzob.Model.Vocabulary.Messages.RawMessage import RawMessage
+
+        messages = list()
+        for i in range(len(self)):
+            message = RawMessage(data=bytes(self.data(i)), date=float(self.timestamp[i]),
+                                 source=self.endpoints[self.source_id[i]], destination=self.endpoints[self.destination_id[i]])
+            messages.append(message)
+
+        return messages
@@ -0,0 +1,56 @@
+import numpy as np
+
+class ObservationArray:
+    """Observation probabilities of all fids as one ragged array
+
+    values:  the probabilities of all fids concatenated (fid by fid, then m/r/s/d/v of each cluster)
+    fids:    the index (in names) of the fid of each value
+    tests:   the constraint of each value (TEST_M, TEST_R, ...)
+    sizes:   the size of the cluster of each value (0 for d/v, which have one value per fid)
+    totals:  the num of messages of the fid of each value
+    """
+    TEST_M, TEST_R, TEST_S, TEST_D, TEST_V = range(5)
+    NUM_TESTS = 5
+
+    # pairs_p: {fid: [p_m, p_r, p_s, p_d, p_v]}, pairs_size: {fid: the size of each cluster}
+    def __init__(self, pairs_p, pairs_size):
+        self.names = list(pairs_p.keys())
+        values, fids, tests, sizes, totals = list(), list(), list(), list(), list()
+        for index, fid in enumerate(self.names):
+            size_list = np.asarray(pairs_size[fid], dtype=np.int64)
+            for test, p_list in enumerate(pairs_p[fid]):
+                num = len(p_list)
+                values.append(np.asarray(p_list, dtype=np.float64))
+                fids.append(np.full(num, index, dtype=np.int64))
+                tests.append(np.full(num, test, dtype=np.int8))
+                sizes.append(size_list[:num] if test in [ObservationArray.TEST_M, ObservationArray.TEST_R, ObservationArray.TEST_S] else np.zeros(num, dtype=np.int64))
+                totals.append(np.full(num, size_list.sum(), dtype=np.int64))
+
+        self.values = np.concatenate(values) if values else np.zeros(0)
+        self.fids = np.concatenate(fids) if fids else np.zeros(0, dtype=np.int64)
+        self.tests = np.concatenate(tests) if tests else np.zeros(0, dtype=np.int8)
+        self.sizes = np.concatenate(sizes) if sizes else np.zeros(0, dtype=np.int64)
+        self.totals = np.concatenate(totals) if totals else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    # copy of the arrays, so the inference of each parameter setting starts from the same observations
+    def copy(self):
+        other = ObservationArray.__new__(ObservationArray)
+        other.names = self.names
+        other.values, other.fids, other.tests = self.values.copy(), self.fids.copy(), self.tests.copy()
+        other.sizes, other.totals = self.sizes.copy(), self.totals.copy()
+        return other
+
+    # keep only the values of mask
+    def select(self, mask):
+        self.values, self.fids, self.tests = self.values[mask], self.fids[mask], self.tests[mask]
+        self.sizes, self.totals = self.sizes[mask], self.totals[mask]
+
+    # output: {fid: [p_m, p_r, p_s, p_d, p_v]} (lists, as pairs_p)
+    def to_lists(self):
+        p_lists = {fid: [list() for _ in range(ObservationArray.NUM_TESTS)] for fid in self.names}
+        for index, test, p in zip(self.fids.tolist(), self.tests.tolist(), self.values.tolist()):
+            p_lists[self.names[index]][test].append(p)
+        return p_lists
@@ -0,0 +1,216 @@
+import argparse
+import ast
+import csv
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from alignment import Alignment
+from field_layout import FieldLayout
+from constraint.constraint import Constraint
+from constraint.executor import CandidateExecutor
+from observation_array import ObservationArray
+from probabilistic_inference import ProbabilisticInference
+
+# state of each worker process, set by the initializer
+_worker_context = dict()
+
+class KeywordGroundTruth:
+    """Score of the keyword candidates against the field boundaries of op_groundtruth/
+
+    The ground truth gives the split indexes (byte offsets of the fields) of each message, not the keyword itself,
+    so a candidate is scored by the proportion of messages where its bytes are exactly one true field.
+    The messages are matched with the aligned messages by their hexstream.
+    """
+
+    def __init__(self, filepath_groundtruth, filepath_output_oneline, layout):
+        splits = self.read_splits(filepath_groundtruth)
+        aligned = self.read_aligned(filepath_output_oneline)
+        self.layout = layout
+        self.scores = dict()
+
+        # byte offset of each column in its message, and the true splits of each aligned message (None if unknown)
+        is_data = (aligned != ord('-')) & (aligned != ord('~'))
+        self.offsets = np.concatenate([np.zeros((len(aligned), 1), dtype=np.int64), np.cumsum(is_data, axis=1)], axis=1) // 2
+        self.splits = [splits.get(bytes(row[mask]).decode().lower()) for row, mask in zip(aligned, is_data)]
+        logging.debug("Ground truth of {}/{} aligned messages".format(sum(s is not None for s in self.splits), len(self.splits)))
+
+    # output: {hexstream: set of the split indexes, with the message length}
+    @staticmethod
+    def read_splits(filepath_groundtruth):
+        assert os.path.isfile(filepath_groundtruth), "The ground truth file doesn't exist"
+
+        splits = dict()
+        with open(filepath_groundtruth, newline='') as f:
+            for row in csv.DictReader(f):
+                hexstream = row["Hexstream"].strip().lower()
+                split_key = [key for key in row if key.startswith("Split Indexes")][0]
+                splits[hexstream] = set(ast.literal_eval(row[split_key])) | {len(hexstream) // 2}
+        return splits
+
+    # output: the aligned messages (uint8 matrix, one row per message)
+    @staticmethod
+    def read_aligned(filepath_output_oneline):
+        assert os.path.isfile(filepath_output_oneline), "The aligned messages file doesn't exist"
+
+        with open(filepath_output_oneline) as f:
+            lines = [line.strip().encode() for line in f if line.strip()]
+        length = max((len(line) for line in lines), default=0)
+        return np.array([list(line.ljust(length, b'-')) for line in lines], dtype=np.uint8).reshape(len(lines), length)
+
+    # proportion of the messages where the field fid is exactly one true field (cached)
+    def score_field(self, fid):
+        if fid not in self.scores:
+            il, ir = self.layout.slice(fid)
+            num_matched, num_messages = 0, 0
+            for splits, start, end in zip(self.splits, self.offsets[:, il].tolist(), self.offsets[:, ir].tolist()):
+                if splits is None:
+                    continue
+                num_messages += 1
+                if start < end and start in splits and end in splits and not any(start < s < end for s in splits):
+                    num_matched += 1
+            self.scores[fid] = num_matched / num_messages if num_messages > 0 else 0.0
+
+        return self.scores[fid]
+
+    # fid_inferred: the fields of the inferred keyword (a composite keyword is the average of its fields)
+    def score(self, fid_inferred):
+        return float(np.mean([self.score_field(fid) for fid in fid_inferred])) if fid_inferred else 0.0
+
+class ParameterSweep:
+    """Keyword decision of a grid of implication parameters (ProbabilisticInference.PARAMETERS)
+
+    The observation probabilities are computed once (prob_*.txt, or in memory) and only the inference
+    is run for each grid point, on a copy of the same ObservationArray. With workers > 1, the grid is split
+    into chunks evaluated in forked worker processes. With a KeywordGroundTruth, each decision is scored.
+    """
+    FILENAME_RESULT = "sweep_result.txt"
+    CHUNK_SIZE = 256
+
+    def __init__(self, pairs_p, pairs_size, groundtruth=None, workers=1):
+        self.pairs_p = pairs_p
+        self.pairs_size = pairs_size
+        self.groundtruth = groundtruth
+        self.workers = workers
+        self.p_observation = ObservationArray(pairs_p, pairs_size)
+        self.fid_list = self.get_fid_list(self.p_observation.names)
+        self.fid_index = [self.p_observation.names.index(fid) for fid in self.fid_list]
+
+    # the cached observation probabilities of the direction the keyword is inferred from, and the alignment of mdiplier in output_dir
+    @classmethod
+    def from_output_dir(cls, output_dir, filepath_groundtruth=None, workers=1):
+        direction, pairs_p, pairs_size = Constraint.read_inference_probabilities(output_dir)
+        logging.debug("Sweep the observation probabilities of the {}".format("requests" if direction == Constraint.TEST_TYPE_REQUEST else "responses"))
+        groundtruth = None
+        if filepath_groundtruth is not None:
+            layout = FieldLayout.from_fieldsinfo(os.path.join(output_dir, Alignment.FILENAME_FIELDS_INFO))
+            groundtruth = KeywordGroundTruth(filepath_groundtruth, os.path.join(output_dir, Alignment.FILENAME_OUTPUT_ONELINE), layout)
+        return cls(pairs_p, pairs_size, groundtruth=groundtruth, workers=workers)
+
+    # the fids inferred by MDIplier.execute: the same field (or composite keyword) on both sides, e.g., "3-3", "3+5-3+5"
+    # the other pairs (-fp) are only part of the normalization, as in the pipeline
+    @staticmethod
+    def get_fid_list(names):
+        return [name for name in names if len(set(name.split("-"))) == 1]
+
+    # grid: {name: list of values}, output: list of {name: value} (all combinations)
+    @staticmethod
+    def get_grid(grid):
+        for name in grid:
+            assert name in ProbabilisticInference.PARAMETERS, "unknown parameter: {}".format(name)
+        names = list(grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+    # params_list: list of {name: value}
+    # output: [params, fid_inferred, pk, score] of each grid point (score is None without ground truth)
+    def execute(self, params_list):
+        print("[++++++++] Sweep {} parameter settings".format(len(params_list)))
+        start = time.time()
+
+        chunks = [params_list[i:i + ParameterSweep.CHUNK_SIZE] for i in range(0, len(params_list), ParameterSweep.CHUNK_SIZE)]
+        if self.workers > 1 and len(chunks) > 1 and CandidateExecutor.is_available():
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(self,)) as executor:
+                decisions = [decision for chunk_decisions in executor.map(_evaluate_chunk, chunks) for decision in chunk_decisions]
+        else:
+            decisions = [decision for chunk in chunks for decision in self.evaluate_chunk(chunk)]
+
+        # the fields are scored in the parent, each distinct field only once
+        results = list()
+        for params, (fid_inferred, pk) in zip(params_list, decisions):
+            score = self.groundtruth.score(fid_inferred) if self.groundtruth is not None else None
+            results.append([params, fid_inferred, pk, score])
+
+        duration = max(time.time() - start, 1e-9)
+        logging.info("[sweep] {} settings in {:.2f}s ({:.0f} settings/s)".format(len(params_list), duration, len(params_list) / duration))
+        return results
+
+    # output: (fid_inferred, pk of the best fid) of each params
+    def evaluate_chunk(self, params_list):
+        decisions = list()
+        for params in params_list:
+            pi = ProbabilisticInference(self.pairs_p, self.pairs_size, params)
+            if len(self.fid_list) == 0:
+                decisions.append(([], 0.0))
+                continue
+            try:
+                pk = pi.compute_pk(self.p_observation.copy())
+            except ZeroDivisionError:
+                # the balance value of the factor graph is undefined (e.g., p_k2x = p_x2k = 0.5)
+                logging.debug("Skip the degenerate setting {}".format(params))
+                decisions.append(([], 0.0))
+                continue
+            fg_result = {fid: [float(pk[i])] for fid, i in zip(self.fid_list, self.fid_index)}
+            decisions.append((pi.get_fid_inferred(fg_result), max(pk_list[0] for pk_list in fg_result.values())))
+        return decisions
+
+    # output: the result with the best score (the first one without ground truth)
+    @staticmethod
+    def get_best(results):
+        if not results:
+            return None
+        return max(results, key=lambda result: result[3] if result[3] is not None else 0.0)
+
+    @staticmethod
+    def save_results(results, output_dir):
+        with open(os.path.join(output_dir, ParameterSweep.FILENAME_RESULT), 'w') as fout:
+            fout.write("params fid_inferred pk score\n")
+            for params, fid_inferred, pk, score in results:
+                fout.write("{} {} {:.6f} {}\n".format(",".join("{}={}".format(name, value) for name, value in params.items()),
+                                                      "+".join(str(fid) for fid in fid_inferred), pk,
+                                                      "{:.6f}".format(score) if score is not None else "-"))
+
+def _init_worker(sweep):
+    _worker_context['sweep'] = sweep
+
+def _evaluate_chunk(params_list):
+    return _worker_context['sweep'].evaluate_chunk(params_list)
+
+# "P_K2M=0.7,0.8,0.9" -> ("P_K2M", [0.7, 0.8, 0.9])
+def parse_grid_arg(arg):
+    name, values = arg.split("=")
+    return name, [ast.literal_eval(value) for value in values.split(",")]
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output_dir', dest='output_dir', default='tmp/', help='output directory of mdiplier (prob_*.txt and the alignment)')
+    parser.add_argument('-g', '--groundtruth', dest='filepath_groundtruth', default=None, help='op_groundtruth file of the trace')
+    parser.add_argument('-p', '--param', dest='params', action='append', default=[], help='values of a parameter, e.g., P_K2M=0.7,0.8,0.9 (repeatable)')
+    parser.add_argument('-w', '--workers', dest='workers', default=1, type=int, help='number of worker processes')
+    args = parser.parse_args()
+
+    sweep = ParameterSweep.from_output_dir(args.output_dir, args.filepath_groundtruth, workers=args.workers)
+    results = sweep.execute(ParameterSweep.get_grid(dict(parse_grid_arg(arg) for arg in args.params)))
+    ParameterSweep.save_results(results, args.output_dir)
+
+    params, fid_inferred, pk, score = ParameterSweep.get_best(results)
+    print("[++++++++] Best setting: {} -> keyword {} (pk {:.4f}, score {})".format(params, fid_inferred, pk, score))
@@ -1,46 +1,85 @@
 import logging
-import copy
 import struct
 import os
-from netzob.Import.PCAPImporter.all import *
-from netzob.Model.Vocabulary.Session import Session
+import hashlib
+import re
+
+from message_store import MessageStore
+from hexstream_reader import HexstreamReader
 
 class Processing:
 
-    def __init__(self, filepath, protocol_type=None, layer=5, messages=None):
+    def __init__(self, filepath, protocol_type=None, layer=5, messages=None, cache_dir=None):
         self.filepath = filepath
         self.protocol_type = protocol_type
         self.layer = layer
         self.messages = messages
         self.direction_list = list()
+        self.direction_list_imported = None
+        self.store = None
+        self.cache_dir = cache_dir
         self.MAX_LEN = 8192
 
         if self.protocol_type:
             assert self.protocol_type in ['dhcp', 'dnp3', 'icmp', 'modbus', 'ntp', 'smb', 'smb2', 'tftp', 'zeroaccess'], 'the protocol_type is unknown'
+        # ICMP: layer = 3 (set before the cache key is computed)
+        if self.protocol_type == 'icmp':
+            self.layer = 3
+        if self.cache_dir and self.load_cache():
+            return
         self.import_messages()
         self.get_msgs_directionlist()
+        self.store = MessageStore.from_messages(self.messages, self.direction_list)
+        if self.cache_dir:
+            self.save_cache()
+
+    ## cache of preprocessed traces
+    ## key: content hash of the input trace, layer, protocol_type and MAX_LEN
+    def get_cache_key(self):
+        h = hashlib.sha256()
+        if os.path.isfile(self.filepath):
+            filepaths = [self.filepath]
+        else:
+            filepaths = [os.path.join(self.filepath, file) for file in sorted(os.listdir(self.filepath))]
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        h.update("{}|{}|{}".format(self.layer, self.protocol_type, self.MAX_LEN).encode())
+
+        return h.hexdigest()
+
+    def get_cache_path(self):
+        return os.path.join(self.cache_dir, self.get_cache_key())
+
+    def load_cache(self):
+        cache_path = self.get_cache_path()
+        if not MessageStore.exists(cache_path):
+            logging.debug("No cached trace in {}".format(cache_path))
+            return False
+
+        print("[++++++++] Load preprocessed messages from cache")
+        self.store = MessageStore.load(cache_path)
+        self.messages = self.store.to_messages()
+        self.direction_list = self.store.direction.tolist()
+
+        return True
+
+    def save_cache(self):
+        cache_path = self.get_cache_path()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.store.save(cache_path)
+        logging.debug("Save preprocessed messages to {}".format(cache_path))
 
     ## import msg
     ## protocol_type: dhcp, dnp3, icmp, modbus, ntp, smb, smb2, tftp, zeroaccess
     def import_messages(self):
         print("[++++++++] Import messages")
-        # ICMP: layer = 3
-        if self.protocol_type == 'icmp':
-            self.layer = 3
         file_path = self.filepath
-        if os.path.isfile(file_path):
-            messages = PCAPImporter.readFile(filePath=self.filepath, importLayer=self.layer).values()
+        if os.path.isfile(file_path) and HexstreamReader.is_supported(file_path):
+            messages = self.import_hexstream_messages(file_path)
         else:
-            messages = None
-            files = os.listdir(self.filepath)
-            
-            for file in files:
-                filepath_input = os.path.join(self.filepath, file)
-                message = PCAPImporter.readFile(filePath=filepath_input, importLayer=self.layer).values()
-                if not messages:
-                    messages = message
-                else:
-                    messages = messages + message
+            messages = self.import_pcap_messages(file_path)
 
         ## Filter messages
         # extract from IP msgs
@@ -78,6 +117,46 @@ class Processing:
 
         self.messages = messages
 
+    # a pcap, or a folder of pcaps
+    def import_pcap_messages(self, file_path):
+        # netzob is slow to import, only load it for pcaps
+        from netzob.Import.PCAPImporter.all import PCAPImporter
+
+        if os.path.isfile(file_path):
+            messages = PCAPImporter.readFile(filePath=self.filepath, importLayer=self.layer).values()
+        else:
+            messages = None
+            files = os.listdir(self.filepath)
+            
+            for file in files:
+                filepath_input = os.path.join(self.filepath, file)
+                message = PCAPImporter.readFile(filePath=filepath_input, importLayer=self.layer).values()
+                if not messages:
+                    messages = message
+                else:
+                    messages = messages + message
+
+        return messages
+
+    # exported datasets (Hexstream json/csv): the data has already been extracted from the layer
+    def import_hexstream_messages(self, filepath):
+        from netzob.Model.Vocabulary.Messages.RawMessage import RawMessage
+
+        messages, direction_list = list(), list()
+        for i, record in enumerate(HexstreamReader(filepath).iter_records()):
+            date = record['timestamp'] if record['timestamp'] is not None else float(i)
+            message = RawMessage(data=record['data'], date=date, source=record['source'], destination=record['destination'])
+            messages.append(message)
+            direction_list.append(record['direction'])
+
+        if all(d is not None for d in direction_list):
+            self.direction_list_imported = direction_list
+        elif any(d is not None for d in direction_list):
+            logging.warning("Some messages have no direction, ignore the direction column")
+        logging.debug("Import {} messages from {}".format(len(messages), filepath))
+
+        return messages
+
     def decrypt_za_msg(self, messagedata_encrypted):
         crc32 = struct.unpack("<I", messagedata_encrypted[0:4])[0]
         if crc32 == 0:
@@ -101,7 +180,13 @@ class Processing:
     def get_msgs_directionlist(self):
         assert self.messages is not None, 'the messages could not be None'
 
-        if not self.protocol_type or self.protocol_type == "tftp":
+        if self.direction_list_imported is not None and len(self.direction_list_imported) == len(self.messages):
+            direction_list = self.direction_list_imported
+        elif not self.protocol_type and HexstreamReader.is_supported(self.filepath) \
+                and all(message.source is None for message in self.messages):
+            raise ValueError("Can not decide the direction of the messages in {}: add a Direction column, "
+                             "Source/Destination columns or give the protocol type (-t)".format(self.filepath))
+        elif not self.protocol_type or self.protocol_type == "tftp":
             direction_list = self.get_msgs_directionlist_by_sessions()
         else: ## get the direction by specification
             direction_list = list()
@@ -114,6 +199,8 @@ class Processing:
         self.direction_list = direction_list
 
     def get_msgs_directionlist_by_sessions(self):
+        from netzob.Model.Vocabulary.Session import Session
+
         dict_idtoi = dict()
         for i,message in enumerate(self.messages):
             dict_idtoi[message.id] = i
@@ -253,12 +340,7 @@ class Processing:
             print("  Symbol {0} msgs numbers: {1}".format(s, types_list_response.count(s)))
 
         ## Session info
-        messages = copy.deepcopy(self.messages)
-        sessions = Session(messages)
-        for i in range(len(self.direction_list)):
-            data = [messages[i].data, self.direction_list[i]]
-            messages[i].data = data
-        num_of_session = len(sessions.getTrueSessions())
+        num_of_session = self.store.num_flows
         print("\nNumber of Sessions: {0}".format(num_of_session))
         print("[++++++++] End\n")
 
@@ -0,0 +1,79 @@
+import argparse
+import os
+import subprocess
+import sys
+
+class StartupBenchmark:
+    """Import time of the CLI modules, from `python -X importtime`
+
+    Each run imports the module in a fresh interpreter and parses the importtime report
+    ("import time: self [us] | cumulative | imported package", nested packages are indented).
+    The time of a module is its cumulative time, the best of num_runs is compared with BUDGET_MS.
+    The heavy dependencies (DEFERRED_MODULES) should only be imported by the stages that use them.
+    """
+    MODULE = "main"
+    BUDGET_MS = 300
+    NUM_RUNS = 5
+    DEFERRED_MODULES = ['netzob', 'sklearn', 'pgmpy', 'torch', 'scipy']
+
+    def __init__(self, module=MODULE, budget_ms=BUDGET_MS, num_runs=NUM_RUNS):
+        self.module = module
+        self.budget_ms = budget_ms
+        self.num_runs = num_runs
+
+    # output: {module: (self us, cumulative us)} of one run
+    def run_once(self):
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(self.module)],
+                                cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("Failed to import {}:\n{}".format(self.module, result.stderr))
+
+        return self.parse_importtime(result.stderr)
+
+    @staticmethod
+    def parse_importtime(report):
+        times = dict()
+        for line in report.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            fields = line[len("import time:"):].split("|")
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+            times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+        return times
+
+    # output: the best import time (ms) of the module, the slowest modules of that run and the deferred modules imported
+    def execute(self, top_n=10):
+        best = None
+        for _ in range(self.num_runs):
+            times = self.run_once()
+            if best is None or times[self.module][1] < best[self.module][1]:
+                best = times
+
+        time_ms = best[self.module][1] / 1000
+        slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:top_n]
+        imported = sorted({name.split(".")[0] for name in best} & set(StartupBenchmark.DEFERRED_MODULES))
+
+        return time_ms, slowest, imported
+
+    def is_within_budget(self, time_ms, imported):
+        return time_ms <= self.budget_ms and len(imported) == 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--module', dest='module', default=StartupBenchmark.MODULE, help='module to import (default: the CLI)')
+    parser.add_argument('-b', '--budget', dest='budget_ms', default=StartupBenchmark.BUDGET_MS, type=float, help='import time budget in ms')
+    parser.add_argument('-n', '--runs', dest='num_runs', default=StartupBenchmark.NUM_RUNS, type=int, help='number of runs, the best one is reported')
+    args = parser.parse_args()
+
+    benchmark = StartupBenchmark(module=args.module, budget_ms=args.budget_ms, num_runs=args.num_runs)
+    time_ms, slowest, imported = benchmark.execute()
+
+    print("[++++++++] Import time of {}: {:.1f} ms (budget {} ms)".format(args.module, time_ms, args.budget_ms))
+    for name, (time_self, time_cumulative) in slowest:
+        print("  {:>8.1f} ms self {:>8.1f} ms cumulative  {}".format(time_self / 1000, time_cumulative / 1000, name))
+    if imported:
+        print("Deferred modules imported at startup: {}".format(", ".join(imported)))
+
+    sys.exit(0 if benchmark.is_within_budget(time_ms, imported) else 1)
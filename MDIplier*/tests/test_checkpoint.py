@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from alignment import Alignment
+from field_layout import FieldLayout
+from constraint.checkpoint import CheckpointStore
+from constraint.constraint import Constraint
+
+# aligned messages (3 fields of 1 byte), alternating requests/responses in two flows
+ALIGNED = ["a1", "b1", "a2", "b2", "c1", "d1", "a1", "b1", "c2", "d2", "c1", "d1"]
+FIELDS_INFO = "Raw 16 16 D\nRaw 16 16 D\nRaw 16 16 D\n"
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.output_dir, Alignment.FILENAME_OUTPUT_ONELINE), 'w') as f:
+            f.write("".join("{}{:02x}ff\n".format(data, i % 3) for i, data in enumerate(ALIGNED)))
+        with open(os.path.join(self.output_dir, Alignment.FILENAME_FIELDS_INFO), 'w') as f:
+            f.write(FIELDS_INFO)
+
+        self.direction_list = [i % 2 for i in range(len(ALIGNED))]
+        self.messages = list()
+        for i, data in enumerate(ALIGNED):
+            client, server = "10.0.0.{}:1000".format(i // 6), "10.0.0.9:502"
+            source, destination = (client, server) if self.direction_list[i] == 0 else (server, client)
+            self.messages.append(types.SimpleNamespace(data=bytes.fromhex(data), date=float(i), source=source, destination=destination))
+        self.layout = FieldLayout.from_fieldsinfo(os.path.join(self.output_dir, Alignment.FILENAME_FIELDS_INFO))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def run_constraint(self, checkpoint):
+        constraint = Constraint(self.messages, self.direction_list, self.layout, [0, 1], output_dir=self.output_dir, checkpoint=checkpoint)
+        return constraint, constraint.compute_observation_probabilities()
+
+    def test_resume(self):
+        checkpoint = CheckpointStore.open_in(self.output_dir, self.direction_list)
+        _, (pairs_p, pairs_size) = self.run_constraint(checkpoint)
+        checkpoint.close()
+        self.assertEqual(sorted(pairs_p[0]), ["0-0", "1-1"])
+
+        # the same alignment and options: both candidates are served from the table, nothing is computed
+        checkpoint = CheckpointStore.open_in(self.output_dir, self.direction_list)
+        self.assertEqual(sorted(checkpoint.load()), ["0-0", "1-1"])
+        constraint = Constraint(self.messages, self.direction_list, self.layout, [0, 1], output_dir=self.output_dir, checkpoint=checkpoint)
+        constraint.evaluate_tasks = lambda tasks: self.fail("the stored candidates are computed again: {}".format(tasks))
+        self.assertEqual(constraint.compute_observation_probabilities(), (pairs_p, pairs_size))
+        checkpoint.close()
+
+        # other options: the stored candidates are not reused
+        checkpoint = CheckpointStore.open_in(self.output_dir, self.direction_list, options=["samples:100"])
+        self.assertEqual(checkpoint.load(), dict())
+        checkpoint.close()
+
+        # another direction list (another trace): the stored candidates are not reused
+        checkpoint = CheckpointStore.open_in(self.output_dir, [1 - d for d in self.direction_list])
+        self.assertEqual(checkpoint.load(), dict())
+        checkpoint.close()
+
+    def test_clear(self):
+        checkpoint = CheckpointStore.open_in(self.output_dir, self.direction_list)
+        self.run_constraint(checkpoint)
+        other = CheckpointStore.open_in(self.output_dir, self.direction_list, options=["nw"])
+        other.append([["0-0", [[0.5]], [2], [[0.5]], [2]]])
+
+        checkpoint.clear()
+        self.assertEqual(checkpoint.load(), dict())
+        # only the rows of its key are removed
+        self.assertEqual(sorted(other.load()), ["0-0"])
+        checkpoint.close()
+        other.close()
+
+if __name__ == '__main__':
+    unittest.main()
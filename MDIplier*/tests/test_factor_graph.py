@@ -0,0 +1,78 @@
+import importlib.util
+import itertools
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from factor_graph import MyFactorGraph
+
+HAS_PGMPY = importlib.util.find_spec("pgmpy") is not None
+
+# type_list: 0: k2x & x2k, 1: k2x, 2: x2k, -1: not test
+def random_graph(rng, type_list):
+    p_observation = [rng.uniform(0.01, 0.99, int(rng.integers(0, 3))).tolist() for _ in type_list]
+    p_ktox = [rng.uniform(0.01, 0.99, len(p_x)).tolist() for p_x in p_observation]
+    p_xtok = [rng.uniform(0.01, 0.99, len(p_x)).tolist() for p_x in p_observation]
+    return {'f': p_observation}, {'f': [p_ktox, p_xtok]}
+
+# P(k = 1) by enumerating all the assignments of k and the observations, with the factors of the pgmpy graph
+def reference_pk(p_observation, p_implication, type_list):
+    p_ktox, p_xtok = p_implication
+    factors = list()
+    for i, test_type in enumerate(type_list):
+        if test_type not in [0, 1, 2]:
+            continue
+        for p1, p2, p3 in zip(p_observation[i], p_ktox[i], p_xtok[i]):
+            # phi(k, x) = phi1(x) * phi2(k, x) * phi3(k, x), values in the order of DiscreteFactor(['k', x])
+            phi2 = [p2, p2, 1 - p2, p2] if test_type in [0, 1] else [1, 1, 1, 1]
+            phi3 = [p3, 1 - p3, p3, p3] if test_type in [0, 2] else [1, 1, 1, 1]
+            factors.append(lambda k, x, p1=p1, phi2=phi2, phi3=phi3: (p1 if x else 1 - p1) * phi2[2 * k + x] * phi3[2 * k + x])
+
+    weights = [0.0, 0.0]
+    for k in [0, 1]:
+        for xs in itertools.product([0, 1], repeat=len(factors)):
+            weights[k] += np.prod([factor(k, x) for factor, x in zip(factors, xs)])
+    return weights[1] / (weights[0] + weights[1])
+
+class TestFactorGraph(unittest.TestCase):
+
+    def test_closed_form_is_the_exact_posterior(self):
+        rng = np.random.default_rng(0)
+        for type_list in [[0, 0, 0, 0, 0], [1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [0, 1, 2, -1, 0]]:
+            for _ in range(20):
+                p_observation, p_implication = random_graph(rng, type_list)
+                pk = MyFactorGraph(p_observation, p_implication).compute_pk(type_list, 'f')
+                self.assertAlmostEqual(pk, reference_pk(p_observation['f'], p_implication['f'], type_list), places=12)
+
+    def test_batch_is_the_graph_of_each_fid(self):
+        rng = np.random.default_rng(1)
+        graphs = [random_graph(rng, [0] * 5) for _ in range(30)]
+        p_x, p_ktox, p_xtok, groups = list(), list(), list(), list()
+        for index, (p_observation, p_implication) in enumerate(graphs):
+            for i in range(5):
+                p_x += p_observation['f'][i]
+                p_ktox += p_implication['f'][0][i]
+                p_xtok += p_implication['f'][1][i]
+                groups += [index] * len(p_observation['f'][i])
+
+        pk = MyFactorGraph.compute_pk_batch(np.array(p_x), np.array(p_ktox), np.array(p_xtok), np.array(groups, dtype=np.int64), len(graphs))
+        for index, (p_observation, p_implication) in enumerate(graphs):
+            self.assertAlmostEqual(pk[index], MyFactorGraph(p_observation, p_implication).compute_pk([0] * 5, 'f'), places=12)
+
+    @unittest.skipUnless(HAS_PGMPY, "pgmpy is not installed")
+    def test_closed_form_is_belief_propagation(self):
+        rng = np.random.default_rng(2)
+        for type_list in [[0, 0, 0, 0, 0], [0, 1, 2, -1, 0]]:
+            for _ in range(10):
+                p_observation, p_implication = random_graph(rng, type_list)
+                if sum(len(p_observation['f'][i]) for i, t in enumerate(type_list) if t in [0, 1, 2]) == 0:
+                    continue
+                fg = MyFactorGraph(p_observation, p_implication)
+                self.assertAlmostEqual(fg.compute_pk(type_list, 'f'), fg.compute_pk_bp(type_list, 'f'), places=9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from constraint.message_similarity import MessageSimilarity
+
+class TestEqualErrorRate(unittest.TestCase):
+
+    def setUp(self):
+        self.similarity = MessageSimilarity(None, aligned=np.zeros((1, 1), dtype=np.uint8))
+
+    # scores of the counts, each repeated by its weight
+    @staticmethod
+    def get_scores(counts, length, weights=None):
+        weights = weights if weights is not None else np.ones(len(counts), dtype=np.int64)
+        return [count / length for count, weight in zip(counts.tolist(), weights.tolist()) for _ in range(weight)]
+
+    def test_histogram_eer_is_compute_eer(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            length = int(rng.integers(1, 30))
+            inner_counts = rng.integers(0, length + 1, int(rng.integers(1, 40)))
+            inter_counts = rng.integers(0, length + 1, int(rng.integers(1, 40)))
+
+            eer = self.similarity.compute_eer(self.get_scores(inner_counts, length), self.get_scores(inter_counts, length))
+            self.assertEqual(self.similarity.compute_eer_by_counts(inner_counts, inter_counts, length), eer)
+
+    def test_weighted_histogram_eer(self):
+        rng = np.random.default_rng(1)
+        for _ in range(200):
+            length = int(rng.integers(1, 30))
+            inner_counts = rng.integers(0, length + 1, int(rng.integers(1, 20)))
+            inter_counts = rng.integers(0, length + 1, int(rng.integers(1, 20)))
+            inner_weights = rng.integers(1, 5, len(inner_counts))
+            inter_weights = rng.integers(1, 5, len(inter_counts))
+
+            eer = self.similarity.compute_eer(self.get_scores(inner_counts, length, inner_weights),
+                                              self.get_scores(inter_counts, length, inter_weights))
+            self.assertEqual(self.similarity.compute_eer_by_counts(inner_counts, inter_counts, length, inner_weights, inter_weights), eer)
+
+    def test_no_inner_or_inter_pairs(self):
+        counts = np.array([1, 2, 3])
+        empty = np.zeros(0, dtype=np.int64)
+        self.assertEqual(self.similarity.compute_eer_by_counts(empty, counts, 4), 1)
+        self.assertEqual(self.similarity.compute_eer_by_counts(counts, empty, 4), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from constraint.constraint import Constraint
+from parameter_sweep import ParameterSweep
+from probabilistic_inference import ProbabilisticInference
+
+# prob_request.txt of a -fp run: the off-diagonal pair "1-2" has the best observations
+PROB_REQUEST = """1-1 0.5,0.6 0.5,0.4 0.6,0.5 0.5 1 10,12
+1-2 0.99,0.98 0.99,0.99 0.99,0.98 0.99 1 10,12
+2-2 0.7,0.8,0.6 0.7,0.6,0.8 0.8,0.7,0.9 0.9 1 8,7,7
+2-1 0.1,0.2,0.1 0.2,0.1,0.3 0.3,0.2,0.1 0.2 1 8,7,7
+3+4-3+4 0.3,0.2 0.4,0.3 0.5,0.4 0.4 1 11,11
+"""
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.output_dir, "prob_request.txt"), 'w') as f:
+            f.write(PROB_REQUEST)
+
+    def test_off_diagonal_pairs_are_not_inferred(self):
+        sweep = ParameterSweep.from_output_dir(self.output_dir)
+        self.assertEqual(sweep.fid_list, ["1-1", "2-2", "3+4-3+4"])
+
+        grid = ParameterSweep.get_grid({'P_K2M': [0.7, 0.8, 0.9], 'P_M2K': [0.6, 0.7]})
+        results = sweep.execute(grid)
+        self.assertEqual(len(results), len(grid))
+        for params, fid_inferred, pk, score in results:
+            self.assertEqual(fid_inferred, [2])
+            self.assertIsNone(score)
+
+    def test_same_decision_as_the_pipeline(self):
+        pairs_p, pairs_size = Constraint.read_observation_probabilities(os.path.join(self.output_dir, "prob_request.txt"))
+        ffid_list = ["1-1", "2-2", "3+4-3+4"]
+        sweep = ParameterSweep(pairs_p, pairs_size)
+        for params in ParameterSweep.get_grid({'P_K2S': [0.7, 0.9], 'WEIGHTED_IMPLICATION': [False, True]}):
+            pi = ProbabilisticInference(pairs_p, pairs_size, params)
+            fg_result = pi.compute_fg_result(ffid_list)
+            [(_, fid_inferred, pk, _)] = sweep.execute([params])
+            self.assertEqual(fid_inferred, pi.get_fid_inferred(fg_result))
+            self.assertAlmostEqual(pk, max(pk_list[0] for pk_list in fg_result.values()))
+
+    def test_no_request_uses_the_responses(self):
+        # a trace without requests: the request observations are empty, the keyword is inferred from the responses
+        with open(os.path.join(self.output_dir, "prob_request.txt"), 'w') as f:
+            f.write("1-1 - - - - - -\n2-2 - - - - - -\n")
+        with open(os.path.join(self.output_dir, "prob_response.txt"), 'w') as f:
+            f.write("1-1 0.3,0.2 0.4,0.3 0.5,0.4 0.4 1 10,12\n2-2 0.7,0.8,0.6 0.7,0.6,0.8 0.8,0.7,0.9 0.9 1 8,7,7\n")
+
+        direction, pairs_p, pairs_size = Constraint.read_inference_probabilities(self.output_dir)
+        self.assertEqual(direction, Constraint.TEST_TYPE_RESPONSE)
+        sweep = ParameterSweep.from_output_dir(self.output_dir)
+        self.assertEqual(sweep.pairs_p, pairs_p)
+        [(_, fid_inferred, pk, _)] = sweep.execute([dict()])
+        self.assertEqual(fid_inferred, ProbabilisticInference(pairs_p, pairs_size).execute(["1-1", "2-2"]))
+        self.assertEqual(fid_inferred, [2])
+
+    def test_requests_are_used(self):
+        direction, pairs_p, _ = Constraint.read_inference_probabilities(self.output_dir)
+        self.assertEqual(direction, Constraint.TEST_TYPE_REQUEST)
+        self.assertEqual(ParameterSweep.from_output_dir(self.output_dir).pairs_p, pairs_p)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import copy
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from factor_graph import MyFactorGraph
+from probabilistic_inference import ProbabilisticInference
+
+# observation probabilities of random fids, with the invalid values of the pipeline (-1, -2, 0)
+def random_pairs(seed, num_fids):
+    rng = np.random.default_rng(seed)
+    pairs_p, pairs_size = dict(), dict()
+    for fid in range(num_fids):
+        num = int(rng.integers(1, 6))
+        p_m = rng.choice([rng.uniform(0, 1), -1, -2], size=num, p=[0.8, 0.1, 0.1]).tolist()
+        p_r = rng.choice([rng.uniform(0, 1), -1, 0], size=num, p=[0.8, 0.1, 0.1]).tolist()
+        p_s = rng.uniform(0, 1, num).tolist()
+        p_d = [float(rng.uniform(0, 1))]
+        p_v = [int(rng.choice([1, -1]))]
+        name = "{0}-{0}".format(fid)
+        pairs_p[name] = [p_m, p_r, p_s, p_d, p_v]
+        pairs_size[name] = rng.integers(1, 20, num).tolist()
+    return pairs_p, pairs_size
+
+# the per-fid loop over the lists of each fid
+def reference_fg_result(pairs_p, pairs_size, pi, weighted):
+    p_observation = copy.deepcopy(pairs_p)
+
+    # normalize the valid values of each constraint over all fids
+    ranges = {0: (None, 0.2, 0.8), 1: ((0, 1), 0.2, 0.8), 2: ((0, 1), 0.2, 0.8), 3: ((0, 1), 0.1, 0.75)}
+    balances = {0: MyFactorGraph.compute_fg_threshold(pi.P_K2M, pi.P_M2K), 1: MyFactorGraph.compute_fg_threshold(pi.P_K2R, pi.P_R2K),
+                2: MyFactorGraph.compute_fg_threshold(pi.P_K2S, pi.P_S2K), 3: 0.95}
+    for test_id, (bounds, low, high) in ranges.items():
+        p_total = [p for fid in p_observation for p in p_observation[fid][test_id] if p >= 0]
+        if len(p_total) == 0:
+            continue
+        min1, max1 = bounds if bounds is not None else (min(p_total), max(p_total))
+        for fid in p_observation:
+            for i, p in enumerate(p_observation[fid][test_id]):
+                if p >= 0:
+                    p_observation[fid][test_id][i] = low + (p - min1) * (high - low) / (max1 - min1) if min(p_total) != max(p_total) else balances[test_id]
+
+    p_implication = dict()
+    for fid, p_lists in p_observation.items():
+        size_sum = sum(pairs_size[fid])
+        bonus = lambda p_list, value: [p + value * (s / size_sum) if p > 0 else p for p, s in zip(p_list, pairs_size[fid])]
+        p_ktox = [[k2x] * len(p_list) for k2x, p_list in zip([pi.P_K2M, pi.P_K2R, pi.P_K2S, pi.P_K2D, pi.P_K2V], p_lists)]
+        p_xtok = [[x2k] * len(p_list) for x2k, p_list in zip([pi.P_M2K, pi.P_R2K, pi.P_S2K, pi.P_D2K, pi.P_V2K], p_lists)]
+        if weighted:
+            p_xtok[:3] = [bonus(p_list, pi.BONUS_VALUE_X2K) for p_list in p_xtok[:3]]
+        p_lists[:3] = [bonus(p_list, 0.2) for p_list in p_lists[:3]]
+
+        # invalid values: m, s, d and v are replaced, r is removed
+        p_balance = MyFactorGraph.compute_fg_threshold(pi.P_K2M, pi.P_M2K)
+        p_lists[0] = [(p_balance if p < -1.5 else 0.4) if p < 0 else p for p in p_lists[0]]
+        keep = [i for i, p in enumerate(p_lists[1]) if p > 0 and pairs_size[fid][i] > 1]
+        p_lists[1] = [p_lists[1][i] for i in keep]
+        p_ktox[1], p_xtok[1] = [p_ktox[1][i] for i in keep], [p_xtok[1][i] for i in keep]
+        p_lists[2] = [0.4 if p < 0 else p for p in p_lists[2]]
+        p_lists[3] = [0.4 if p < 0 else p for p in p_lists[3]]
+        p_lists[4] = [MyFactorGraph.compute_fg_threshold(pi.P_K2V, pi.P_V2K) - 0.45 if p < 0 else 0.95 for p in p_lists[4]]
+        p_implication[fid] = [p_ktox, p_xtok]
+
+    fg = MyFactorGraph(p_observation=p_observation, p_implication=p_implication)
+    return {fid: [fg.compute_pk([0, 0, 0, 0, 0], fid)] for fid in pairs_p}
+
+class TestProbabilisticInference(unittest.TestCase):
+
+    def assert_same_result(self, fg_result, fg_result_reference):
+        self.assertEqual(list(fg_result), list(fg_result_reference))
+        for fid in fg_result:
+            self.assertAlmostEqual(fg_result[fid][0], fg_result_reference[fid][0], places=12)
+
+    def test_vectorized_is_the_per_fid_loop(self):
+        for seed in range(30):
+            pairs_p, pairs_size = random_pairs(seed, int(np.random.default_rng(seed).integers(1, 12)))
+            for weighted in [False, True]:
+                pi = ProbabilisticInference(pairs_p, pairs_size, {'WEIGHTED_IMPLICATION': weighted})
+                self.assert_same_result(pi.compute_fg_result(), reference_fg_result(pairs_p, pairs_size, pi, weighted))
+
+    def test_parameters(self):
+        pairs_p, pairs_size = random_pairs(100, 8)
+        params = {'P_K2M': 0.7, 'P_M2K': 0.65, 'P_K2R': 0.8, 'P_S2K': 0.7, 'BONUS_VALUE_X2K': 0.1}
+        pi = ProbabilisticInference(pairs_p, pairs_size, params)
+        self.assert_same_result(pi.compute_fg_result(), reference_fg_result(pairs_p, pairs_size, pi, False))
+
+    def test_equal_values_are_set_to_the_balance(self):
+        pairs_p = {"1-1": [[0.5, 0.5], [0.7, 0.7], [0.9, 0.9], [0.3], [1]], "2-2": [[0.5], [0.7], [0.9], [0.3], [-1]]}
+        pairs_size = {"1-1": [3, 4], "2-2": [7]}
+        pi = ProbabilisticInference(pairs_p, pairs_size)
+        self.assert_same_result(pi.compute_fg_result(), reference_fg_result(pairs_p, pairs_size, pi, False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from processing import Processing
+
+HAS_NETZOB = importlib.util.find_spec("netzob") is not None
+
+# IPv4 header (20 bytes) + ICMP echo request/reply
+IP_HEADER = "4500001c000100004001f6e5c0a80001c0a80002"
+ICMP_MESSAGES = [
+    (IP_HEADER + "0800f7fe00010001", 0),
+    (IP_HEADER + "0000fffe00010001", 1),
+    (IP_HEADER + "0800f7fd00010002", 0),
+    (IP_HEADER + "0000fffd00010002", 1),
+]
+
+@unittest.skipUnless(HAS_NETZOB, "netzob is not installed")
+class TestProcessingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.filepath = os.path.join(self.tmp_dir, "icmp.json")
+        with open(self.filepath, 'w') as f:
+            json.dump([{"Hexstream": hexstream, "Direction": direction} for hexstream, direction in ICMP_MESSAGES], f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_icmp_cache_is_loaded(self):
+        processing = Processing(filepath=self.filepath, protocol_type='icmp', cache_dir=self.cache_dir)
+        self.assertEqual(processing.layer, 3)
+        self.assertEqual(os.listdir(self.cache_dir), [processing.get_cache_key()])
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            cached = Processing(filepath=self.filepath, protocol_type='icmp', cache_dir=self.cache_dir)
+        self.assertIn("Load preprocessed messages from cache", stdout.getvalue())
+        self.assertNotIn("Import messages", stdout.getvalue())
+        self.assertEqual(os.listdir(self.cache_dir), [processing.get_cache_key()])
+        self.assertEqual(cached.layer, 3)
+        self.assertEqual(cached.direction_list, [direction for _, direction in ICMP_MESSAGES])
+        # the IP header is stripped before caching
+        self.assertEqual([message.data for message in cached.messages], [message.data for message in processing.messages])
+        self.assertEqual(cached.messages[0].data, bytes.fromhex("0800f7fe00010001"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from message_store import MessageStore
+from constraint.field_clusters import FieldClusters
+from constraint.remote_coupling import RemoteCoupling
+
+# random trace: flows of interleaved requests/responses, ties in timestamps, sessions that start with responses
+def random_trace(seed, num, num_flows):
+    rng = np.random.default_rng(seed)
+    direction = rng.integers(0, 2, num).astype(np.int8)
+    timestamp = rng.integers(0, num // 2 + 1, num).astype(np.float64)
+    flow_id = rng.integers(0, num_flows, num).astype(np.int32)
+    store = MessageStore(np.zeros(0, dtype=np.uint8), np.zeros(num + 1, dtype=np.int64),
+                         direction=direction, timestamp=timestamp, flow_id=flow_id)
+    return store, direction.tolist()
+
+def random_clusters(rng, num, num_symbols):
+    labels = rng.integers(0, num_symbols, num)
+    labels[:min(num, num_symbols)] = np.arange(min(num, num_symbols))
+    num_symbols = int(labels.max()) + 1 if num > 0 else 0
+    return FieldClusters(labels, ["s{}".format(label) for label in range(num_symbols)])
+
+# the session loop: each response is paired with the previous request of its flow, sessions are sorted by date
+def reference_p_r(store, direction_list, clusters_request, clusters_response):
+    direction = np.asarray(direction_list)
+    symbol = [None] * len(direction)
+    for i, label in zip(np.flatnonzero(direction == 0), clusters_request.labels):
+        symbol[i] = (0, label)
+    for i, label in zip(np.flatnonzero(direction != 0), clusters_response.labels):
+        symbol[i] = (1, label)
+
+    counts = {s: dict() for s in [(0, label) for label in range(len(clusters_request))] + [(1, label) for label in range(len(clusters_response))]}
+    order = np.lexsort((store.timestamp, store.flow_id))
+    for session in np.split(order, np.flatnonzero(np.diff(store.flow_id[order])) + 1):
+        request = None
+        for i in session:
+            if direction_list[i] == 0:
+                request = symbol[i]
+            elif request is not None:
+                counts[request][symbol[i]] = counts[request].get(symbol[i], 0) + 1
+                counts[symbol[i]][request] = counts[symbol[i]].get(request, 0) + 1
+
+    p_r = [list(), list()]
+    for (d, label), count in sorted(counts.items()):
+        p = max(count.values()) / sum(count.values()) if count else 0
+        p_r[d].append(p if p > 0 else -1)
+    return p_r
+
+class TestRemoteCoupling(unittest.TestCase):
+
+    def test_session_pairs_are_the_session_loop(self):
+        for seed in range(20):
+            rng = np.random.default_rng(seed)
+            store, direction_list = random_trace(seed, int(rng.integers(1, 80)), int(rng.integers(1, 6)))
+            num_request = direction_list.count(0)
+            clusters_request = random_clusters(rng, num_request, int(rng.integers(1, 5)))
+            clusters_response = random_clusters(rng, len(direction_list) - num_request, int(rng.integers(1, 5)))
+
+            rc = RemoteCoupling(clusters_request, clusters_response, RemoteCoupling.get_session_pairs(store, direction_list))
+            rc.compute_pairs_by_directionlist()
+            p_r_request, p_r_response = reference_p_r(store, direction_list, clusters_request, clusters_response)
+
+            self.assertEqual(rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_REQUEST), p_r_request)
+            self.assertEqual(rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_RESPONSE), p_r_response)
+
+if __name__ == '__main__':
+    unittest.main()
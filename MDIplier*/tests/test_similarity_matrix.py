@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from constraint.constraint import Constraint
+from constraint.message_similarity import MessageSimilarity
+from constraint.similarity_matrix import SimilarityMatrix
+from constraint.unique_rows import UniqueRows
+
+# random aligned messages: a few symbols and gaps, so many columns are equal
+def random_aligned(seed, num, length):
+    rng = np.random.default_rng(seed)
+    aligned = rng.choice(np.frombuffer(b"0123-", dtype=np.uint8), size=(num, length))
+    return np.ascontiguousarray(aligned)
+
+# score of each pair as in the per-pair scorer: the proportion of equal columns
+def reference_scores(aligned):
+    num, length = aligned.shape
+    scores = np.empty((num, num))
+    for i in range(num):
+        for j in range(num):
+            scores[i, j] = SimilarityMatrix.SCORE_SELF if i == j else sum(a == b for a, b in zip(aligned[i], aligned[j])) / length
+    return scores
+
+class TestSimilarityMatrix(unittest.TestCase):
+
+    def test_match_counts_are_the_per_pair_scores(self):
+        for seed, (num, length) in enumerate([(1, 5), (2, 1), (17, 9), (40, 23)]):
+            aligned = random_aligned(seed, num, length)
+            similarity = MessageSimilarity(None, aligned=aligned)
+            similarity.compute_similarity_matrix()
+            matrix = similarity.similarity_matrix
+
+            expected = reference_scores(aligned)
+            np.testing.assert_array_equal(matrix.get_block(np.arange(num), np.arange(num)), expected)
+            for i in range(num):
+                np.testing.assert_array_equal(matrix.get_row(i), expected[i])
+
+    def test_small_blocks(self):
+        aligned = random_aligned(7, 30, 11)
+        block_bytes = MessageSimilarity.BLOCK_BYTES
+        # blocks of a few rows, so the matrix is filled by many set_block calls
+        MessageSimilarity.BLOCK_BYTES = 1000
+        try:
+            similarity = MessageSimilarity(None, aligned=aligned)
+            similarity.compute_similarity_matrix()
+        finally:
+            MessageSimilarity.BLOCK_BYTES = block_bytes
+
+        np.testing.assert_array_equal(similarity.similarity_matrix.get_block(np.arange(30), np.arange(30)), reference_scores(aligned))
+
+class TestSimilarityMatrixMemmap(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.memmap_bytes = Constraint.SIMILARITY_MEMMAP_BYTES
+
+    def tearDown(self):
+        Constraint.SIMILARITY_MEMMAP_BYTES = self.memmap_bytes
+        shutil.rmtree(self.output_dir)
+
+    def test_memmap_is_the_in_memory_matrix(self):
+        aligned = {Constraint.TEST_TYPE_REQUEST: random_aligned(0, 40, 12), Constraint.TEST_TYPE_RESPONSE: random_aligned(1, 25, 12)}
+        constraint = Constraint(list(), list(), None, list(), output_dir=self.output_dir)
+        constraint.unique_rows = {d: UniqueRows(aligned[d]) for d in aligned}
+        constraint.messages_aligned = {d: None for d in aligned}
+        # every matrix is backed by a file
+        Constraint.SIMILARITY_MEMMAP_BYTES = 0
+        constraint.prepare_evaluation()
+
+        for d in aligned:
+            rows = constraint.unique_rows[d].rows
+            matrix = constraint.constraint_m[d].similarity_matrix
+            self.assertIsInstance(matrix.counts, np.memmap)
+            self.assertIsNotNone(matrix.filepath)
+            # the backing file is unlinked once it is mapped
+            self.assertFalse(os.path.exists(matrix.filepath))
+
+            similarity = MessageSimilarity(None, aligned=rows)
+            similarity.compute_similarity_matrix()
+            self.assertNotIsInstance(similarity.similarity_matrix.counts, np.memmap)
+            num = len(rows)
+            np.testing.assert_array_equal(matrix.get_block(np.arange(num), np.arange(num)),
+                                          similarity.similarity_matrix.get_block(np.arange(num), np.arange(num)))
+            for i in range(num):
+                np.testing.assert_array_equal(matrix.get_row(i), similarity.similarity_matrix.get_row(i))
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mdiplier"))
+
+from constraint.constraint import Constraint
+from constraint.field_clusters import FieldClusters
+from constraint.message_similarity import MessageSimilarity
+from constraint.unique_rows import UniqueRows
+
+# aligned messages drawn from a few distinct rows (repeated messages, e.g., polling), with gaps
+def random_aligned(seed, num, num_distinct, length):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(np.frombuffer(b"012-", dtype=np.uint8), size=(num_distinct, length))
+    return np.ascontiguousarray(rows[rng.integers(0, num_distinct, num)])
+
+# p_m of each symbol from the scores of all message pairs (the per-message path)
+def reference_p_m(aligned, labels):
+    similarity = MessageSimilarity(None, aligned=np.zeros((1, 1), dtype=np.uint8))
+    num, length = aligned.shape
+    scores = (aligned[:, None, :] == aligned[None, :, :]).sum(axis=2) / length
+    num_symbols = labels.max() + 1
+    p_m = list()
+    for label in range(num_symbols):
+        indices = np.flatnonzero(labels == label)
+        others = np.flatnonzero(labels != label)
+        inner = [scores[i, j] for k, i in enumerate(indices) for j in indices[k + 1:]]
+        inter = [scores[i, j] for i in indices for j in others]
+        p = 1 - similarity.compute_eer(inner, inter)
+        p_m.append(p if p > 0 else (-2 if num_symbols == 1 else -1))
+    return p_m
+
+# p_s of each symbol from its messages (the per-message path)
+def reference_p_s(aligned, labels):
+    p_s = list()
+    for label in range(labels.max() + 1):
+        messages = aligned[labels == label]
+        num_gap_extra = int(np.count_nonzero((messages == Constraint.GAP).all(axis=0)))
+        num_gap = sum(int(np.count_nonzero(message == Constraint.GAP)) - num_gap_extra for message in messages)
+        p_s.append(1 - (num_gap / len(messages)) / (aligned.shape[1] - num_gap_extra))
+    return p_s
+
+class TestUniqueRows(unittest.TestCase):
+
+    def setUp(self):
+        self.constraint = Constraint(list(), list(), None, list())
+
+    def get_probabilities(self, aligned, il, ir, unique_rows=None):
+        rows = unique_rows.rows if unique_rows is not None else aligned
+        labels, names = Constraint.get_field_labels(rows, il, ir)
+        clusters = FieldClusters(labels, names, unique_rows)
+
+        similarity = MessageSimilarity(None, aligned=rows)
+        similarity.compute_similarity_matrix()
+        p_m = similarity.compute_constraint_message_similarity(clusters)
+
+        gaps = rows == Constraint.GAP
+        p_s = self.constraint.compute_constraint_structure(clusters, gaps, np.count_nonzero(gaps, axis=1))
+
+        return clusters, p_m, p_s
+
+    def test_unique_rows(self):
+        aligned = random_aligned(0, 50, 8, 6)
+        unique_rows = UniqueRows(aligned)
+        np.testing.assert_array_equal(unique_rows.rows[unique_rows.inverse], aligned)
+        self.assertEqual(unique_rows.weights.sum(), len(aligned))
+        # rows in the order of their first message
+        _, index_first = np.unique(unique_rows.inverse, return_index=True)
+        self.assertTrue((np.diff(index_first) > 0).all())
+
+    def test_weighted_rows_are_the_messages(self):
+        for seed in range(20):
+            rng = np.random.default_rng(seed)
+            length = int(rng.integers(3, 10))
+            aligned = random_aligned(seed, int(rng.integers(10, 60)), int(rng.integers(2, 12)), length)
+            il = int(rng.integers(0, length - 1))
+            ir = il + int(rng.integers(1, 3))
+
+            clusters_weighted, p_m_weighted, p_s_weighted = self.get_probabilities(aligned, il, ir, UniqueRows(aligned))
+            clusters, p_m, p_s = self.get_probabilities(aligned, il, ir)
+
+            self.assertEqual(clusters_weighted.names, clusters.names)
+            np.testing.assert_array_equal(clusters_weighted.labels, clusters.labels)
+            np.testing.assert_array_equal(clusters_weighted.sizes, clusters.sizes)
+            self.assertEqual(p_m_weighted, p_m)
+            self.assertEqual(p_m, reference_p_m(aligned, clusters.labels))
+            np.testing.assert_allclose(p_s_weighted, p_s, rtol=0, atol=1e-12)
+            np.testing.assert_allclose(p_s, reference_p_s(aligned, clusters.labels), rtol=0, atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()